@@ -54,6 +54,6 @@ setup(name        = "dsc",
       package_dir = {'dsc': 'src'},
       install_requires = ['numpy', 'pandas>=0.24.1', 'sympy', 'numexpr',
                           'sos>=0.20.11', 'sos-pbs>=0.20.1', 'h5py', 'PTable',
-                          'pyarrow>=0.5.0', 'sqlalchemy', 'tzlocal',
+                          'pyarrow>=0.17.0', 'sqlalchemy', 'tzlocal',
                           'msgpack-python']
       )
@@ -29,12 +29,14 @@ class Timer(object):
         self.verbose = False
 
 
-def remove(workflows, groups, modules, db, purge=False):
+def remove(workflows, groups, modules, db, purge=False, dryrun=False, jobs=4):
     from .dsc_database import remove_unwanted_output, remove_obsolete_output
     if purge and modules:
         remove_unwanted_output(workflows, groups, modules, db, zap=False)
+    elif purge and dryrun:
+        remove_obsolete_output(db, dryrun=True, jobs=jobs)
     elif purge:
-        remove_obsolete_output(db)
+        remove_obsolete_output(db, jobs=jobs)
         # Clean up task signatures
         env.logger.info("Cleaning up obsolete job cache ...")
         from sos.__main__ import cmd_purge
@@ -70,7 +72,24 @@ def plain_remove(outdir):
             os.remove(item)
 
 
+def merge(shards, output, jobs=4):
+    from .dsc_database import merge_output
+    if output is None:
+        raise ValueError("``--merge`` must be specified with ``-o``.")
+    env.logger.info(
+        f"Merging ``{len(shards)}`` output folders to ``{output}`` ...")
+    data = merge_output(shards, output, jobs)
+    env.logger.info(
+        f"Database ``{output}/{os.path.basename(output)}.db`` of ``{len([x for x in data if not x.startswith('.')])}`` modules is created."
+    )
+
+
 def execute(args, unknown_args):
+    if args.merge:
+        merge(args.merge, args.output, args.__max_jobs__)
+        return
+    if args.dsc_file is None:
+        raise ValueError("DSC script is required.")
     if args.to_remove:
         if args.target is None and args.to_remove not in ('obsolete', 'all'):
             raise ValueError("``-d`` must be specified with ``--target``.")
@@ -84,60 +103,87 @@ def execute(args, unknown_args):
     from .utils import workflow2html, dsc2html, transcript2html
     from sos import execute_workflow
     from .dsc_parser import DSC_Script, DSC_Pipeline, remote_config_parser
-    from .dsc_translator import DSC_Translator
-    # Parse DSC script
-    script = DSC_Script(args.dsc_file,
-                        output=args.output,
-                        sequence=args.target,
-                        global_params=unknown_args,
-                        truncate=args.truncate,
-                        replicate=1 if args.truncate else args.replicate)
-    script.init_dsc(env)
-    pipeline_obj = DSC_Pipeline(script).pipelines
-    # Apply clean-up
-    if args.to_remove:
-        if args.to_remove == 'all':
-            plain_remove(script.runtime.output)
+    from .dsc_translator import DSC_Translator, TranslationCache
+    # Reuse translation of DSC script from previous run if nothing has changed
+    cache = None if args.to_remove or args.debug else TranslationCache(
+        args.dsc_file, [
+            args.target, args.truncate, args.replicate, args.output,
+            args.host, args.__construct__, args.__max_jobs__,
+            args.__sqlite__, args.__materialize__, args.__timing__,
+            args.__workers__, unknown_args
+        ])
+    translation = cache.load() if cache else None
+    if translation is None:
+        # Parse DSC script
+        script = DSC_Script(args.dsc_file,
+                            output=args.output,
+                            sequence=args.target,
+                            global_params=unknown_args,
+                            truncate=args.truncate,
+                            replicate=1 if args.truncate else args.replicate)
+        DSC_Script.init_dsc(script.runtime.output, env)
+        pipeline_obj = DSC_Pipeline(script).pipelines
+        # Apply clean-up
+        if args.to_remove:
+            if args.to_remove == 'all':
+                plain_remove(script.runtime.output)
+            else:
+                remove(pipeline_obj, {
+                    **script.runtime.concats,
+                    **script.runtime.groups
+                }, rm_objects, script.runtime.output, args.to_remove == 'obsolete',
+                           args.dryrun, args.__max_jobs__)
+            return
+        db = os.path.basename(script.runtime.output)
+        # Archive scripts
+        lib_content = [(f"From <code>{k}</code>", sorted(glob.glob(f"{k}/*.*")))
+                       for k in script.runtime.options['lib_path'] or []]
+        exec_content = [(k, script.modules[k].exe)
+                        for k in script.runtime.sequence_ordering]
+        dsc2html('\n'.join(script.transcript), script.runtime.output,
+                 script.runtime.sequence, exec_content, lib_content,
+                 script.print_help(to_html=True))
+        env.logger.info(f"DSC script exported to ``{script.runtime.output}.html``")
+        if args.debug:
+            workflow2html(f'{DSC_CACHE}/{db}_workflow.html', pipeline_obj,
+                          list(script.dump().values()))
+        # Resolve executable paths
+        # FIXME: always assume args.host is a Linux machine and not checking it
+        exec_path = [
+            os.path.join(
+                k, 'mac' if platform.system() == 'Darwin' and args.host is None
+                else 'linux') for k in (script.runtime.options['exec_path'] or [])
+        ] + (script.runtime.options['exec_path'] or [])
+        exec_path = [x for x in exec_path if os.path.isdir(x)]
+        # Generate remote job configuration settings
+        if args.host:
+            conf = remote_config_parser(args.host, exec_path)
+            conf_tpl = {'localhost': 'localhost', 'hosts': conf['DSC']}
         else:
-            remove(pipeline_obj, {
-                **script.runtime.concats,
-                **script.runtime.groups
-            }, rm_objects, script.runtime.output, args.to_remove == 'obsolete')
-        return
-    db = os.path.basename(script.runtime.output)
-    # Archive scripts
-    lib_content = [(f"From <code>{k}</code>", sorted(glob.glob(f"{k}/*.*")))
-                   for k in script.runtime.options['lib_path'] or []]
-    exec_content = [(k, script.modules[k].exe)
-                    for k in script.runtime.sequence_ordering]
-    dsc2html('\n'.join(script.transcript), script.runtime.output,
-             script.runtime.sequence, exec_content, lib_content,
-             script.print_help(to_html=True))
-    env.logger.info(f"DSC script exported to ``{script.runtime.output}.html``")
-    if args.debug:
-        workflow2html(f'{DSC_CACHE}/{db}_workflow.html', pipeline_obj,
-                      list(script.dump().values()))
-    # Resolve executable paths
-    # FIXME: always assume args.host is a Linux machine and not checking it
-    exec_path = [
-        os.path.join(
-            k, 'mac' if platform.system() == 'Darwin' and args.host is None
-            else 'linux') for k in (script.runtime.options['exec_path'] or [])
-    ] + (script.runtime.options['exec_path'] or [])
-    exec_path = [x for x in exec_path if os.path.isdir(x)]
-    # Generate remote job configuration settings
-    if args.host:
-        conf = remote_config_parser(args.host, exec_path)
-        conf_tpl = {'localhost': 'localhost', 'hosts': conf['DSC']}
+            conf = conf_tpl = dict()
+        # Obtain pipeline scripts
+        pipeline = DSC_Translator(
+            pipeline_obj, script.runtime, args.__construct__ == "none",
+            args.__max_jobs__, False, None
+            if len(conf) == 0 else {k: v
+                                    for k, v in conf.items() if k != 'DSC'},
+            args.debug and args.verbosity == 0, {
+                'sqlite': args.__sqlite__,
+                'materialize': args.__materialize__,
+                'timing': args.__timing__,
+                'jobs': args.__max_jobs__
+            }, args.__workers__ and not args.host)
+        if cache:
+            cache.save(script, (pipeline, exec_path, conf_tpl),
+                       [f'{script.runtime.output}.html'] +
+                       ([args.host] if args.host else []),
+                       [f"{k}/*.*" for k in script.runtime.options['lib_path'] or []])
     else:
-        conf = conf_tpl = dict()
-    # Obtain pipeline scripts
-    pipeline = DSC_Translator(
-        pipeline_obj, script.runtime, args.__construct__ == "none",
-        args.__max_jobs__, False, None
-        if len(conf) == 0 else {k: v
-                                for k, v in conf.items() if k != 'DSC'},
-        args.debug and args.verbosity == 0)
+        pipeline, exec_path, conf_tpl = translation
+        db = pipeline.db
+        DSC_Script.init_dsc(pipeline.output, env)
+        env.logger.info(
+            f"DSC script ``{args.dsc_file}`` is unchanged since previous run; reusing its translation ...")
     # Generate DSC meta databases
     env.logger.info(f"Constructing DSC from ``{args.dsc_file}`` ...")
     script_prepare = pipeline.get_pipeline("prepare", args.debug)
@@ -181,6 +227,10 @@ def execute(args, unknown_args):
         return
     env.logger.debug(f"Running command ``{' '.join(sys.argv)}``")
     env.logger.info(f"Building execution graph & running DSC ...")
+    workers = None
+    if args.__workers__ and args.host is None:
+        from .dsc_worker import WorkerPool
+        workers = WorkerPool(args.__max_jobs__)
     try:
         settings['error_mode'] = args.error_mode
         settings['verbosity'] = args.verbosity if args.host else max(
@@ -200,6 +250,9 @@ def execute(args, unknown_args):
                                "the errors;\nadditional scripts upstream of the error can be found in " \
                                f"``{db}.scripts.html``.\n" + '=' * 75)
         raise Exception(e)
+    finally:
+        if workers is not None:
+            workers.close()
     # Plot DAG
     if args.__dag__:
         from sos.utils import dot_to_gif
@@ -234,6 +287,7 @@ def main():
                     add_help=False)
     p.add_argument('dsc_file',
                    metavar="DSC script",
+                   nargs='?',
                    help='DSC script to execute.')
     ce = p.add_argument_group('Benchmark options')
     ce.add_argument('--target',
@@ -283,6 +337,24 @@ def main():
                    "all": skips all modules and only build meta-database required to run `dsc-query` command.
                    It can be used for salvaging a partially completed benchmark making it possible to query from it.
                    "none": force executes DSC from scratch.''')
+    mt.add_argument('--sqlite',
+                    action='store_true',
+                    dest='__sqlite__',
+                    help='''Additionally build an indexed SQLite database "<output>.sqlite"
+                   next to the meta-database, so that "dsc-query" runs queries directly on it
+                   instead of loading module tables into memory for every query.''')
+    mt.add_argument('--materialize',
+                    action='store_true',
+                    dest='__materialize__',
+                    help='''Load values of module output variables that are scalars or short vectors
+                   to the meta-database, so that "dsc-query" can extract and filter on them
+                   as it does on parameters, without reading output files.''')
+    mt.add_argument('--timing',
+                    action='store_true',
+                    dest='__timing__',
+                    help='''Collect elapsed time and replicate of module instances, saved in their
+                   output files, to the meta-database, so that "dsc-query" can extract "DSC_TIME"
+                   of modules without reading output files.''')
     mt.add_argument('--touch',
                     action='store_true',
                     dest='__recover__',
@@ -311,6 +383,18 @@ def main():
                    until they are needed for re-running a downstream module.
                    It can be used to remove large yet unused intermediate module output without triggering re-runs when possible.'''
                     )
+    mt.add_argument('--dry-run',
+                    action='store_true',
+                    dest='dryrun',
+                    help='''Used with "-d obsolete" without "--target", report number and size of files
+                   that would be removed from output folder, without removing them.''')
+    mt.add_argument('--merge',
+                    metavar="folder",
+                    nargs='+',
+                    help='''Merge output folders of parts of a benchmark, eg from runs of different
+                   "--target" or replicates, to output folder specified by "-o", without running DSC.
+                   Output files are linked rather than copied, and renamed where necessary;
+                   the merged meta-database can be queried by "dsc-query".''')
     ro = p.add_argument_group('Computing options')
     ro.add_argument(
         '-c',
@@ -321,6 +405,13 @@ def main():
         help=
         '''Maximum number of CPU threads for local runs, or job managing sockets for remote execution.'''
     )
+    ro.add_argument(
+        '--python-workers',
+        action='store_true',
+        dest='__workers__',
+        help='''Run instances of Python modules in a pool of at most "-c" long-lived local Python processes,
+                   which import libraries once and are reused across instances, rather than in a new
+                   Python process per instance. Not used for remote execution.''')
     ro.add_argument(
         '-v',
         '--verbosity',
@@ -41,20 +41,31 @@ def query(args):
     from sos.__main__ import AnswerMachine
     # from sos_notebook.converter import notebook_to_html
     from .query_jupyter import get_database_notebook, get_query_notebook
-    from .query_engine import Query_Processor
+    from .query_engine import Query_Processor, Federated_Query_Processor
+    from .query_cache import QueryCache, OutputCache
     from .utils import uniq_list
     am = AnswerMachine(always_yes=args.force)
-    if os.path.isfile(args.dsc_output):
-        if args.dsc_output.endswith('.db'):
-            args.dsc_output = os.path.dirname(args.dsc_output)
-        else:
-            preview(args.dsc_output, args.output, am)
-            sys.exit(0)
+    for idx, x in enumerate(args.dsc_output):
+        if os.path.isfile(x):
+            if x.endswith('.db'):
+                args.dsc_output[idx] = os.path.dirname(x)
+            elif len(args.dsc_output) == 1:
+                preview(x, args.output, am)
+                sys.exit(0)
+            else:
+                raise ValueError(
+                    f'Cannot query ``{x}`` along with other DSC output folders.')
     args.output = args.output.strip('.')
-    db = os.path.join(
-        args.dsc_output,
-        os.path.basename(os.path.normpath(args.dsc_output)) + '.db')
+    dbs = [
+        os.path.join(x,
+                     os.path.basename(os.path.normpath(x)) + '.db')
+        for x in args.dsc_output
+    ]
+    db = dbs[0]
     if args.target is None:
+        if len(dbs) > 1:
+            raise ValueError(
+                'Query targets are required for multiple DSC output folders.')
         if not args.output.endswith('.ipynb'):
             fnb = args.output + '.ipynb'
         else:
@@ -67,16 +78,30 @@ def query(args):
                               args.limit)
     else:
         logger.info("Running queries ...")
-        qp = Query_Processor(db, args.target, args.condition, args.groups)
+        caches = [
+            QueryCache(os.path.join(x, '.query_cache'), args.cache_size)
+            if args.cache else None for x in args.dsc_output
+        ]
+        if len(dbs) > 1:
+            # rows are labelled by the database they are from
+            qp = Federated_Query_Processor(dbs, args.target, args.condition,
+                                           args.groups, args.engine,
+                                           args.jobs, caches)
+        else:
+            qp = Query_Processor(db, args.target, args.condition,
+                                 args.groups, args.engine, args.jobs,
+                                 caches[0])
         for query in qp.get_queries():
             logger.debug(query)
         # convert output database
         if args.rds is not None:
-            fns = sum([
-                list(qp.output_table[x]) for x in qp.output_table.columns
-                if x.endswith(':output') or x.endswith('.output.file')
-            ], [])
-            fns = [os.path.join(os.path.dirname(db), x) for x in fns]
+            fns = sum([[
+                os.path.join(os.path.dirname(p.db), x)
+                for x in p.output_table[y] if isinstance(x, str)
+            ] for p in getattr(qp, 'processors', [qp])
+                       for y in p.output_table.columns
+                       if y.endswith(':output') or y.endswith('.output.file')],
+                      [])
             if args.rds == 'omit':
                 fns = [
                     x + '.pkl' for x in fns
@@ -105,31 +130,42 @@ def query(args):
                 except Exception as e:
                     logger.warning(
                         f"Failed to convert {len(fns)} files to RDS: {e}")
+        # load values of module outputs
+        if args.load_outputs:
+            # every output folder has its own cache, as for query results
+            caches = [
+                OutputCache(os.path.join(x, '.query_cache', 'outputs.sqlite'))
+                if args.cache else None for x in args.dsc_output
+            ]
+            qp.load_outputs(args.jobs, caches if len(dbs) > 1 else caches[0])
         # write output
-        if not args.output.endswith('.xlsx') and not args.output.endswith(
-                '.ipynb') and not args.output.endswith('.csv'):
-            fnb = args.output + '.ipynb'
-            fxlsx = args.output + '.xlsx'
-            fcsv = None
-        elif args.output.endswith('.xlsx'):
+        from .dsc_io import save_arrow, ARROW_EXTENSIONS
+        ext = os.path.splitext(args.output)[1]
+        fnb = fxlsx = fcsv = farrow = None
+        if ext == '.xlsx':
             fxlsx = args.output
-            fnb = fcsv = None
-        elif args.output.endswith('.csv'):
+        elif ext == '.csv':
             fcsv = args.output
-            fnb = fxlsx = None
-        else:
+        elif ext in ARROW_EXTENSIONS:
+            farrow = args.output
+        elif ext == '.ipynb':
             fnb = args.output
-            fcsv = None
-            fxlsx = args.output[:-6] + '.xlsx'
-        if fxlsx is not None and os.path.isfile(
-                fxlsx) and not am.get(f"Overwrite existing file \"{fxlsx}\"?"):
-            sys.exit("Aborted!")
-        if fnb is not None and os.path.isfile(
-                fnb) and not am.get(f"Overwrite existing file \"{fnb}\"?"):
-            sys.exit("Aborted!")
-        if fcsv is not None and os.path.isfile(
-                fcsv) and not am.get(f"Overwrite existing file \"{fcsv}\"?"):
-            sys.exit("Aborted!")
+            farrow = args.output[:-6] + '.parquet'
+        else:
+            fnb = args.output + '.ipynb'
+            farrow = args.output + '.parquet'
+        # tables of each pipeline are saved next to the merged table
+        farrows = []
+        if farrow is not None:
+            farrows.append(farrow)
+            if len(qp.output_tables) > 1:
+                base, suffix = os.path.splitext(farrow)
+                farrows.extend(
+                    [f'{base}.{table}{suffix}' for table in qp.output_tables])
+        for fn in [fxlsx, fnb, fcsv] + farrows:
+            if fn is not None and os.path.isfile(
+                    fn) and not am.get(f"Overwrite existing file \"{fn}\"?"):
+                sys.exit("Aborted!")
         if fxlsx is not None:
             writer = pd.ExcelWriter(fxlsx)
             qp.output_table.to_excel(writer, 'Sheet1', index=False)
@@ -142,10 +178,17 @@ def query(args):
             logger.info(
                 f"Query results saved to spreadsheet ``{fxlsx}``".format(
                     fxlsx))
+        if farrow is not None:
+            tables = [qp.output_table]
+            if len(qp.output_tables) > 1:
+                tables.extend(qp.output_tables.values())
+            for table, fn in zip(tables, farrows):
+                save_arrow(table, fn)
+            logger.info(f"Query results saved to ``{farrow}``")
         if fnb is not None:
             desc = (args.description or []) + ['Queries performed for:\n\n* targets: `{}`\n* conditions: `{}`'.\
                                                format(repr(args.target), repr(args.condition))]
-            get_query_notebook(fxlsx, qp.get_queries(), fnb,
+            get_query_notebook(farrows, qp.get_queries(), fnb,
                                args.title, desc, args.language,
                                uniq_list(args.addon or []), args.limit)
         if fcsv is not None:
@@ -180,15 +223,18 @@ def main():
     p.add_argument('--version', action='version', version=__version__)
     p.add_argument('dsc_output',
                    metavar="DSC output folder or a single output file",
-                   help='')
+                   nargs='+',
+                   help='''Query results of several DSC output folders are put together,
+                   with column "source" for the folder of each row.''')
     p.add_argument('-o',
                    '--output',
                    metavar="str",
                    required=True,
                    help='''Output notebook / data file name.
-                   In query applications if file name ends with ".csv", ".ipynb" or ".xlsx" then only data file will be saved
-                   as result of query. Otherwise both data file in ".xlsx" format and a notebook that displays the data
-                   will be saved.''')
+                   In query applications if file name ends with ".csv", ".xlsx", ".parquet", ".feather" or ".arrow"
+                   then only data file will be saved as result of query; tables of each pipeline are saved to
+                   "<name>.<pipeline>.<extension>" for the last three formats. Otherwise both data file in ".parquet"
+                   format and a notebook that displays the data will be saved.''')
     p.add_argument(
         '--limit',
         metavar='N',
@@ -224,6 +270,44 @@ def main():
                    metavar="G:A,B",
                    nargs='+',
                    help='''Definition of module groups.''')
+    p.add_argument(
+        '--engine',
+        metavar='str',
+        choices=['sqlite', 'pandas'],
+        default='sqlite',
+        help='''Backend to execute queries: "sqlite" loads tables to SQLite
+                   (or uses the on-disk SQLite database when available), "pandas" joins and
+                   filters tables natively with vectorized operations.''')
+    p.add_argument(
+        '-j',
+        '--jobs',
+        metavar='N',
+        type=int,
+        default=1,
+        help='''Number of threads to run queries of different pipelines in parallel,
+                   and of processes to load output files with "--load-outputs".'''
+    )
+    p.add_argument(
+        '--load-outputs',
+        action='store_true',
+        help='''Load values of module output variables in query targets,
+                   instead of reporting names of files they are saved to. Only scalar
+                   values are loaded. Files are loaded in parallel by "-j" processes and
+                   values loaded are kept in cache until files are changed.''')
+    p.add_argument(
+        '--no-cache',
+        action='store_false',
+        dest='cache',
+        help='''Do not use or update the cache of query results, which is kept
+                   in folder ".query_cache" of DSC output and is invalidated automatically
+                   when the database changes.''')
+    p.add_argument(
+        '--cache-size',
+        metavar='MB',
+        type=int,
+        default=1024,
+        help='''Size limit of query result cache. Least recently used results
+                   are removed when the limit is exceeded.''')
     p.add_argument(
         '--language',
         metavar='str',
@@ -3,74 +3,248 @@ __author__ = "Gao Wang"
 __copyright__ = "Copyright 2016, Stephens lab"
 __email__ = "gaow@uchicago.edu"
 __license__ = "MIT"
-import os, msgpack, glob, pickle, copy, shutil
+import os, msgpack, glob, pickle, copy, shutil, sqlite3, json
 import pandas as pd
 from collections import OrderedDict
+from collections.abc import MutableMapping
 from .utils import uniq_list, flatten_list, chunks, remove_multiple_strings, extend_dict, \
-    remove_quotes, DBError
+    remove_quotes, xxh, dump_mpk_records, load_mpk_records, MpkRecords, DBError
 from .addict import Dict as dotdict
 from .syntax import DSC_CACHE
 
 
-def remove_obsolete_output(output, additional_files=None, rerun=False):
-    from sos.__main__ import cmd_remove
-    map_db = f'{output}/{os.path.basename(output)}.map.mpk'
-    # Load existing file names
-    if os.path.isfile(map_db) and not rerun:
-        map_data = msgpack.unpackb(open(map_db, 'rb').read(),
-                                   encoding='utf-8',
-                                   object_pairs_hook=OrderedDict)
-    else:
-        map_data = OrderedDict()
-    # Remove file signature when files are deleted
-    to_remove = []
-    for k, x in list(map_data.items()):
-        if k == '__base_ids__':
-            continue
-        x = os.path.join(output, x)
-        if not (os.path.isfile(x) or os.path.isfile(x + '.zapped')):
-            to_remove.append(x)
-            del map_data[k]
+class NameMap:
+    '''
+    Map of module instances to names of their output files, kept in a SQLite
+    database indexed by instance so that it is updated in transactions and
+    names are looked up without loading the whole map. The map is imported
+    from the msgpack file saved by previous versions of DSC, if found.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        legacy = os.path.splitext(filename)[0] + '.mpk'
+        migrate = not os.path.isfile(filename) and os.path.isfile(legacy)
+        self.conn = sqlite3.connect(filename, timeout=60)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS names (key TEXT PRIMARY KEY, name TEXT NOT NULL)'
+            )
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS base_ids (sequence TEXT PRIMARY KEY, ids TEXT NOT NULL)'
+            )
+        if migrate:
+            data = load_mpk_records(legacy)
+            base_ids = data.pop('__base_ids__', dict())
+            self.update(data.items(), base_ids)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM names').fetchone()[0]
+
+    def get(self, key, default=None):
+        res = self.conn.execute('SELECT name FROM names WHERE key = ?',
+                                (key, )).fetchone()
+        return default if res is None else res[0]
+
+    def get_many(self, keys):
+        '''Names of instances in `keys` that are in the map'''
+        keys = list(keys)
+        res = dict()
+        # stay below the limit of SQLite on number of variables
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            res.update(
+                self.conn.execute(
+                    f'SELECT key, name FROM names WHERE key IN ({",".join(["?"] * len(batch))})',
+                    batch))
+        return res
+
+    def items(self):
+        return self.conn.execute('SELECT key, name FROM names ORDER BY rowid')
+
+    def values(self):
+        return [x[0] for x in self.conn.execute('SELECT name FROM names')]
+
+    def get_base_ids(self):
+        '''Highest IDs of module instances by sequence'''
+        return dict([(k, json.loads(v, object_pairs_hook=OrderedDict))
+                     for k, v in self.conn.execute(
+                         'SELECT sequence, ids FROM base_ids')])
+
+    def update(self, names, base_ids=None, clear=False):
+        '''Add `names` and `base_ids` in one transaction, optionally replacing all entries'''
+        with self.conn:
+            if clear:
+                self.conn.execute('DELETE FROM names')
+                self.conn.execute('DELETE FROM base_ids')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO names (key, name) VALUES (?, ?)',
+                names)
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO base_ids (sequence, ids) VALUES (?, ?)',
+                [(k, json.dumps(v)) for k, v in (base_ids or dict()).items()])
+
+    def remove(self, keys):
+        with self.conn:
+            self.conn.executemany('DELETE FROM names WHERE key = ?',
+                                  [(k, ) for k in keys])
+
+    def stale(self, folder, files=None):
+        '''
+        Entries whose files no longer exist in `folder`, as (key, path), where
+        `files` are paths of files in `folder` if already known.
+        '''
+        exists = os.path.isfile if files is None else files.__contains__
+        stale = []
+        for k, x in self.items():
+            x = os.path.join(folder, x)
+            if not (exists(x) or exists(x + '.zapped')):
+                stale.append((k, x))
+        return stale
+
+    def compact(self, folder, files=None):
+        '''
+        Remove entries whose files no longer exist in `folder`, and reclaim
+        the space they took. Returns paths of files removed.
+        '''
+        stale = self.stale(folder, files)
+        if len(stale):
+            self.remove([x[0] for x in stale])
+            self.conn.execute('VACUUM')
+        return [x[1] for x in stale]
+
+    def close(self):
+        self.conn.close()
+
+
+def get_map_db(output):
+    '''File name map of DSC output folder `output`'''
+    return f'{output}/{os.path.basename(output)}.map.sqlite'
+
+
+def scan_output(folder, jobs=4):
+    '''
+    Find files in `folder` and its sub-folders, walked in parallel, as
+    {path: size}. Hidden files and folders, and files without extension,
+    are skipped.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    def scan(dirname, recursive):
+        files, dirs = dict(), []
+        with os.scandir(dirname) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif '.' in entry.name:
+                    files[entry.path] = entry.stat().st_size
+        if recursive:
+            for x in dirs:
+                files.update(scan(x, True)[0])
+        return files, dirs
+
+    if not os.path.isdir(folder):
+        return dict()
+    files, dirs = scan(folder, False)
+    # every module has its own folder
+    with ThreadPoolExecutor(max(jobs, 1)) as pool:
+        for res in pool.map(lambda x: scan(x, True)[0], dirs):
+            files.update(res)
+    return files
+
+
+def remove_files(files, jobs=4):
+    '''Remove `files` in batches from a pool of threads'''
+    from concurrent.futures import ThreadPoolExecutor
+
+    def remove(batch):
+        for x in batch:
+            try:
+                os.remove(x)
+            except FileNotFoundError:
+                pass
+
+    with ThreadPoolExecutor(max(jobs, 1)) as pool:
+        list(pool.map(remove, chunks(list(files), 1000)))
+
+
+def remove_obsolete_output(output,
+                           additional_files=None,
+                           rerun=False,
+                           dryrun=False,
+                           jobs=4):
+    '''
+    Remove files in `output` that are not output of module instances in file
+    name map, along with entries of the map whose files are deleted.
+    Output files replaced by `.zapped` placeholders, and `.stdout` and
+    `.stderr` of output files are kept.
+    '''
+    from sos.utils import pretty_size
+    map_db = get_map_db(output)
+    map_data = NameMap(map_db)
+    files = scan_output(output, jobs)
+    # Entries of files deleted
+    stale = [] if rerun else map_data.stale(output, files)
     # Remove files that are not in the name database
-    for x in glob.glob(f'{output}/**/*.*', recursive=True):
-        if x.endswith(".zapped"):
-            x = x[:-7]
-            x_ext = '.zapped'
-        else:
-            x_ext = ''
-        x_name = os.path.join(os.path.basename(os.path.split(x)[0]),
-                              os.path.basename(x))
-        if x_name not in map_data.values() and \
-           x not in [f'{output}/{os.path.basename(output)}.{i}.mpk' for i in ['conf', 'map']] and \
-               x != f'{output}/{os.path.basename(output)}.db':
-            to_remove.append(x + x_ext)
+    names = set() if rerun else set(map_data.values())
+    stems = set([os.path.splitext(x)[0] for x in names])
+    keep = set([
+        f'{output}/{os.path.basename(output)}.{i}'
+        for i in ['conf.mpk', 'map.mpk', 'db', 'sqlite']
+    ])
+    tables = get_db_tables(f'{output}/{os.path.basename(output)}.db')
+    to_remove = OrderedDict()
+    for x, size in files.items():
+        if x in keep or x.startswith(map_db) or os.path.dirname(x) == tables:
+            continue
+        x_name = x[:-7] if x.endswith(".zapped") else x
+        x_name = os.path.join(os.path.basename(os.path.split(x_name)[0]),
+                              os.path.basename(x_name))
+        if x_name in names:
+            continue
+        stem, ext = os.path.splitext(x_name)
+        if ext in ['.stdout', '.stderr'] and stem in stems:
+            continue
+        to_remove[x] = size
     # Additional files to remove
     for x in additional_files or []:
-        if not os.path.isfile(x):
-            to_remove.append(x)
+        if os.path.isdir(x):
+            to_remove.update(scan_output(x, jobs))
+        elif os.path.isfile(x):
+            to_remove[x] = os.path.getsize(x)
     if rerun:
-        to_remove = list(
-            glob.glob(
-                f'{DSC_CACHE}/{os.path.basename(output)}_*.mpk')) + to_remove
+        for x in glob.glob(f'{DSC_CACHE}/{os.path.basename(output)}_*.mpk'):
+            to_remove[x] = os.path.getsize(x)
+    if dryrun:
+        map_data.close()
+        print(
+            f"Would remove {len(to_remove)} files ({pretty_size(sum(to_remove.values()))}), "
+            f"and {len(stale)} entries of deleted files from ``{map_db}``.")
+        return to_remove
+    if len(stale):
+        map_data.compact(output, files)
+        print(f"Removed {len(stale)} entries of deleted files from ``{map_db}``.")
+    if len(to_remove) and rerun:
+        map_data.update([], clear=True)
+    map_data.close()
     if len(to_remove):
-        open(map_db, "wb").write(msgpack.packb(map_data))
-        # Do not limit to tracked or untracked, and do not just remove signature
-        cmd_remove(
-            dotdict({
-                "tracked": False,
-                "untracked": False,
-                "targets": to_remove,
-                "external": True,
-                "__confirm__": True,
-                "signature": False,
-                "verbosity": 0,
-                "zap": False,
-                "size": None,
-                "age": None,
-                "dryrun": False
-            }), [])
-    else:
+        remove_files(to_remove, jobs)
+        print(
+            f"Removed {len(to_remove)} files ({pretty_size(sum(to_remove.values()))})."
+        )
+    elif not len(stale):
         print("Nothing found to remove!")
+    return to_remove
 
 
 def remove_unwanted_output(workflows, groups, modules, db, zap=False):
@@ -106,7 +280,7 @@ def remove_unwanted_output(workflows, groups, modules, db, zap=False):
         for item in to_remove:
             os.remove(item)
     elif zap:
-        data = pickle.load(open(filename, 'rb'))
+        data = load_db(filename)
         to_remove.extend(
             flatten_list([[
                 glob.glob(os.path.join(db, f'{x}.*'))
@@ -135,6 +309,137 @@ def remove_unwanted_output(workflows, groups, modules, db, zap=False):
         print("Nothing found to remove!")
 
 
+def get_name_ids(key, name):
+    '''IDs of modules of instance `key` in its file name `name`'''
+    ids = os.path.splitext(remove_multiple_strings(name, key.split(':')[::2]))[0]
+    return [int(s) for s in ids.split('_') if s.isdigit()]
+
+
+def link_files(files, jobs=4):
+    '''
+    Hard link files in (source, destination) pairs `files`, or make symbolic
+    links if files are on different file systems, from a pool of threads.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    def link(batch):
+        for src, dest in batch:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            try:
+                os.link(src, dest)
+            except FileExistsError:
+                pass
+            except OSError:
+                os.symlink(os.path.abspath(src), dest)
+
+    with ThreadPoolExecutor(max(jobs, 1)) as pool:
+        list(pool.map(link, chunks(list(files), 1000)))
+
+
+def merge_output(shards, output, jobs=4):
+    '''
+    Merge output folders `shards` of parts of a benchmark, eg runs of
+    different targets or replicates, to output folder `output`.
+    - Module instances found in more than one shard are kept once
+    - Output files are renamed if their names are taken by other module
+      instances, and are linked to `output` instead of being copied
+    - Tables of result databases are put together, and file name map is
+      merged so that DSC can continue the benchmark in `output`
+    '''
+    name = os.path.basename(output)
+    if os.path.isfile(f'{output}/{name}.db'):
+        raise DBError(
+            f"Cannot merge to ``{output}``: database ``{output}/{name}.db`` already exists."
+        )
+    # {instance: file name}
+    merged = OrderedDict()
+    used = set()
+    # {sequence: {module: highest ID}}
+    base_ids = dict()
+    tables = OrderedDict()
+    meta = OrderedDict()
+    to_link = []
+    for shard in shards:
+        shard = shard.rstrip('/')
+        shard_db = f'{shard}/{os.path.basename(shard)}.db'
+        map_db = get_map_db(shard)
+        if not os.path.isfile(shard_db) or not (
+                os.path.isfile(map_db)
+                or os.path.isfile(os.path.splitext(map_db)[0] + '.mpk')):
+            raise DBError(
+                f"Cannot merge ``{shard}``: database or file name map is missing."
+            )
+        shard_map = NameMap(map_db)
+        for key, ids in shard_map.get_base_ids().items():
+            for module, idx in ids.items():
+                base = base_ids.setdefault(key, OrderedDict())
+                base[module] = max(base.get(module, 0), idx)
+        # names of output files to replace in table, without extension
+        renamed = dict()
+        for key, x in shard_map.items().fetchall():
+            stem, ext = os.path.splitext(x)
+            if key in merged:
+                if merged[key] != x:
+                    renamed[stem] = os.path.splitext(merged[key])[0]
+                continue
+            modules = [y[0] for y in uniq_list(reversed(list(chunks(key.split(':'), 2))))]
+            ids = get_name_ids(key, x)
+            base = base_ids.setdefault(':'.join(modules), OrderedDict())
+            for module, idx in zip(modules, ids):
+                base[module] = max(base.get(module, 0), idx)
+            new_name = x
+            if x in used:
+                base[modules[-1]] += 1
+                ids[-1] = base[modules[-1]]
+                new_name = f'{key.split(":", 1)[0]}/' + '_'.join(
+                    [f'{m}_{i}' for m, i in zip(modules, ids)]) + ext
+                renamed[stem] = os.path.splitext(new_name)[0]
+            merged[key] = new_name
+            used.add(new_name)
+            for src, dest in [(x, new_name), (x + '.zapped', new_name + '.zapped')] + \
+                    [(stem + y, os.path.splitext(new_name)[0] + y) for y in ['.stdout', '.stderr']]:
+                if os.path.isfile(os.path.join(shard, src)):
+                    to_link.append((os.path.join(shard, src), os.path.join(output, dest)))
+        shard_map.close()
+        # tables and meta-data
+        data = load_db(shard_db)
+        for k in data:
+            if k == '.build':
+                # database is not updated incrementally from shards
+                continue
+            value = data[k]
+            if isinstance(value, pd.DataFrame):
+                if len(renamed) and '__output__' in value.columns:
+                    value = value.copy()
+                    value['__output__'] = value['__output__'].astype(object).map(
+                        lambda y: renamed.get(y, y))
+                tables.setdefault(k, []).append(value)
+            elif k not in meta:
+                meta[k] = copy.deepcopy(value)
+            elif isinstance(value, dict):
+                for kk, vv in value.items():
+                    if kk not in meta[k]:
+                        meta[k][kk] = vv
+                    elif isinstance(vv, list) and isinstance(meta[k][kk], list):
+                        meta[k][kk] = uniq_list(meta[k][kk] + vv)
+            elif isinstance(value, list) and isinstance(meta[k], list):
+                meta[k] = uniq_list(meta[k] + value)
+    res = OrderedDict()
+    for k, value in tables.items():
+        value = pd.concat(value, ignore_index=True, sort=False)
+        if '__id__' in value.columns and '__parent__' in value.columns:
+            value = value.loc[~value[['__id__', '__parent__']].astype(object).
+                              duplicated()].reset_index(drop=True)
+        res[k] = set_column_types(value)
+    res.update(meta)
+    link_files(to_link, jobs)
+    names = NameMap(get_map_db(output))
+    names.update(merged.items(), base_ids, clear=True)
+    names.close()
+    save_db(res, f'{output}/{name}.db')
+    return res
+
+
 def build_config_db(io_db, map_db, conf_db, vanilla=False, jobs=4):
     '''
     - collect all output file names in md5 style
@@ -148,12 +453,22 @@ def build_config_db(io_db, map_db, conf_db, vanilla=False, jobs=4):
         # map_data is updated non-randomly
         # return is a list of original name and new name mapping
         names = OrderedDict()
+        # IDs of new module instances in every sequence, by order of appearance
+        # {sequence: {module: {hash: ID}}}
         lookup = dict()
-        base_ids = map_data[
-            '__base_ids__'] if '__base_ids__' in map_data else dict()
+        # highest IDs of module instances in every sequence already in map
+        base_ids = dict() if vanilla else map_data.get_base_ids()
+        # sequences whose highest IDs are not saved to map
+        # (by previous versions of DSC) have to be found from file names
+        unknown = set()
         # 1. collect sequence names and hash
-        for k in list(data.keys()):
-            for kk in data[k]:
+        for k, value in data.stream():
+            # names of instances of this module already in map
+            existing = dict() if vanilla else map_data.get_many([
+                x.split(' ')[0] for x in value
+                if x not in ["__ext__", "__input_output___"]
+            ])
+            for kk in value:
                 if kk in ["__ext__", "__input_output___"]:
                     continue
                 kk = kk.split(' ')[0]
@@ -171,100 +486,292 @@ def build_config_db(io_db, map_db, conf_db, vanilla=False, jobs=4):
                 key = ':'.join(k_core)
                 if key not in base_ids:
                     base_ids[key] = dict([(x, 0) for x in k_core])
+                    unknown.add(key)
                 if key not in lookup:
                     lookup[key] = dict()
-                if kk in map_data:
+                if kk in existing:
                     # same module signature already exist
                     # will not work on the name map of these
+                    names[kk] = existing[kk]
+                    if key not in unknown:
+                        continue
                     # but will have to find their max ids
                     # so that we know how to properly name new comers
                     # ie we count how many times each of the module has occured
                     # in this particular sequence
-                    ids = os.path.splitext(
-                        remove_multiple_strings(map_data[kk],
-                                                kk.split(':')[::2]))[0]
-                    ids = [int(s) for s in ids.split('_') if s.isdigit()]
+                    ids = get_name_ids(kk, existing[kk])
                     for i, x in enumerate(base_ids[key].keys()):
                         base_ids[key][x] = max(base_ids[key][x], ids[i])
-                    names[kk] = map_data[kk]
                 else:
-                    lookup[key] = extend_dict(lookup[key],
-                                              dict(content),
-                                              unique=True)
+                    for x, y in dict(content).items():
+                        ids = lookup[key].setdefault(x, dict())
+                        if y not in ids:
+                            ids[y] = len(ids) + 1
                     names[kk] = content
-                    names[kk].append(data[k]["__ext__"])
+                    names[kk].append(value["__ext__"])
         new_base_ids = copy.deepcopy(base_ids)
+        new_names = []
         for k in names:
             # existing items in map_data, skip them
             if isinstance(names[k], str):
                 continue
+            new_names.append(k)
             # new items to be processed
             k_core = dict(names[k][:-1])
             key = ':'.join(tuple(k_core.keys()))
             # 2. replace the hash with an ID
             new_name = []
             for kk in k_core:
-                new_id = base_ids[key][kk] + lookup[key][kk].index(
-                    k_core[kk]) + 1
+                new_id = base_ids[key][kk] + lookup[key][kk][k_core[kk]]
                 new_name.append(f'{kk}_{new_id}')
                 new_base_ids[key][kk] = max(new_base_ids[key][kk], new_id)
             # 3. construct name map
             names[k] = f'{k.split(":", 1)[0]}/' + '_'.join(
                 new_name) + f'.{names[k][-1]}'
-        names['__base_ids__'] = new_base_ids
-        return names
+        return names, new_names, new_base_ids
 
-    def update_map(names):
-        '''Update maps and write to disk'''
-        map_data.update(names)
-        open(map_db, "wb").write(msgpack.packb(map_data))
+    def update_map(names, new_names, base_ids):
+        '''Add new names to map in one transaction'''
+        map_data.update([(k, names[k]) for k in new_names],
+                        base_ids,
+                        clear=vanilla)
 
-    #
-    if os.path.isfile(map_db) and not vanilla:
-        map_data = msgpack.unpackb(open(map_db, 'rb').read(),
-                                   encoding='utf-8',
-                                   object_pairs_hook=OrderedDict)
-    else:
-        map_data = OrderedDict()
-    data = msgpack.unpackb(open(io_db, 'rb').read(),
-                           encoding='utf-8',
-                           object_pairs_hook=OrderedDict)
-    meta_data = msgpack.unpackb(open(io_db[:-4] + '.meta.mpk', 'rb').read(),
-                                encoding='utf-8',
-                                object_pairs_hook=OrderedDict)
-    map_names = get_names()
-    update_map(map_names)
-    fid = os.path.dirname(str(conf_db))
-    conf = OrderedDict()
-    for key in meta_data:
-        workflow_id = str(key)
-        if workflow_id not in conf:
-            conf[workflow_id] = OrderedDict()
-        for module in meta_data[key]:
-            k = f'{module}:{key}'
-            if k not in data:
-                k = f'{meta_data[key][module][0]}:{meta_data[key][module][1]}'
-                # FIXME: this will be a bug if ever triggered
+    def get_conf():
+        '''Generate input, output and dependencies of modules by pipeline'''
+        fid = os.path.dirname(str(conf_db))
+        for key in meta_data:
+            conf = OrderedDict()
+            for module in meta_data[key]:
+                k = f'{module}:{key}'
                 if k not in data:
-                    raise DBError(
-                        f"Cannot find key ``{k}`` in DSC I/O records.")
-                conf[workflow_id][module] = (str(meta_data[key][module][1]),
-                                             meta_data[key][module][0])
-                continue
-            if module not in conf[workflow_id]:
-                conf[workflow_id][module] = OrderedDict()
-            conf[workflow_id][module]['input'] = [os.path.join(fid, map_data[item]) \
-                                        for item in data[k]['__input_output___'][0]]
-            conf[workflow_id][module]['output'] = [os.path.join(fid, map_data[item]) \
-                                         for item in data[k]['__input_output___'][1]]
-            # eg. ['normal:a9f57519', 'median:98b37c9a:normal:a9f57519']
-            depends_steps = uniq_list(
-                [x.split(':')[0] for x in data[k]['__input_output___'][0]])
-            conf[workflow_id][module]['depends'] = [
-                meta_data[key][x] for x in depends_steps
-            ]
+                    k = f'{meta_data[key][module][0]}:{meta_data[key][module][1]}'
+                    # FIXME: this will be a bug if ever triggered
+                    if k not in data:
+                        raise DBError(
+                            f"Cannot find key ``{k}`` in DSC I/O records.")
+                    conf[module] = (str(meta_data[key][module][1]),
+                                    meta_data[key][module][0])
+                    continue
+                io = data[k]['__input_output___']
+                names = map_data.get_many(list(io[0]) + list(io[1]))
+                conf[module] = OrderedDict()
+                conf[module]['input'] = [
+                    os.path.join(fid, names[item]) for item in io[0]
+                ]
+                conf[module]['output'] = [
+                    os.path.join(fid, names[item]) for item in io[1]
+                ]
+                # eg. ['normal:a9f57519', 'median:98b37c9a:normal:a9f57519']
+                depends_steps = uniq_list([x.split(':')[0] for x in io[0]])
+                conf[module]['depends'] = [
+                    meta_data[key][x] for x in depends_steps
+                ]
+            yield str(key), conf
+
     #
-    open(conf_db, "wb").write(msgpack.packb(conf))
+    map_data = NameMap(map_db)
+    # records of module instances are loaded one at a time
+    data = MpkRecords(io_db)
+    meta_data = load_mpk_records(io_db[:-4] + '.meta.mpk')
+    update_map(*get_names())
+    dump_mpk_records(conf_db, get_conf())
+    map_data.close()
+
+
+def set_column_types(table, ratio=0.5):
+    '''
+    Store columns of `table` holding numbers only as numeric columns, and
+    text columns with at most `ratio` distinct values per row, such as
+    `__parent__`, as categoricals that are saved dictionary encoded.
+    '''
+    table = table.infer_objects()
+    for col in table.columns[table.dtypes == object]:
+        if pd.api.types.infer_dtype(table[col], skipna=True) == 'string' and \
+           table[col].nunique() <= ratio * len(table):
+            table[col] = table[col].astype('category')
+    return table
+
+
+def write_sqlite_db(data, filename):
+    '''
+    Write module tables to an on-disk SQLite database, one table per module,
+    with B-tree indexes on `__id__` and `__parent__` so that the chained
+    joins generated by `Query_Processor` can be executed in place.
+    '''
+    tmp_file = filename + '.tmp'
+    if os.path.isfile(tmp_file):
+        os.remove(tmp_file)
+    conn = sqlite3.connect(tmp_file)
+    try:
+        for module, table in data.items():
+            if module.startswith('.') or not isinstance(table, pd.DataFrame):
+                continue
+            table = table.copy()
+            # SQLite only takes scalars; eg tuple parameters are stored as text
+            for col in table.columns[table.dtypes == object]:
+                table[col] = table[col].apply(
+                    lambda x: repr(x) if isinstance(x, (list, tuple, dict)) else x)
+            table.to_sql(module, conn, index=False)
+            for col in ['__id__', '__parent__']:
+                if col in table.columns:
+                    conn.execute(
+                        f'CREATE INDEX "{module}{col}idx" ON "{module}" ("{col}")')
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_file, filename)
+
+
+# entries of database saved as text files next to the manifest
+DB_TEXT_KEYS = ['.html']
+
+
+def get_db_tables(filename):
+    '''Folder of module tables of database `filename`'''
+    return filename[:-3] + '.tables'
+
+
+def save_db(data, filename):
+    '''
+    Save result database as a manifest to `filename`, a pickle of meta-data
+    of the benchmark (`.groups`, `.depends`, `.output`, `.pipelines`, ...),
+    with every module table saved to an Arrow IPC file in folder
+    `get_db_tables(filename)` to be loaded on demand by `LazyDB`.
+    Tables of a `LazyDB` that are not loaded are kept as is.
+    '''
+    import uuid
+    from .dsc_io import save_ipc
+    folder = get_db_tables(filename)
+    os.makedirs(folder, exist_ok=True)
+    # tables of one build are stamped to tell if they match the manifest
+    stamp = uuid.uuid4().hex
+    manifest = OrderedDict()
+    lazy = OrderedDict()
+    for k in list(data.keys()):
+        if isinstance(data, LazyDB) and k in data.lazy and not data.is_loaded(k):
+            lazy[k] = data.lazy[k]
+            continue
+        value = data[k]
+        if isinstance(value, pd.DataFrame):
+            save_ipc(value, os.path.join(folder, f'{k}.{stamp}.arrow'),
+                     dict(stamp=stamp))
+            lazy[k] = (f'{k}.{stamp}.arrow', stamp,
+                       [str(x) for x in value.columns])
+        elif k in DB_TEXT_KEYS and isinstance(value, str):
+            with open(os.path.join(folder, f'{k[1:]}.{stamp}.txt'), 'w') as f:
+                f.write(value)
+            lazy[k] = (f'{k[1:]}.{stamp}.txt', stamp, None)
+        else:
+            manifest[k] = value
+    manifest['.keys'] = list(data.keys())
+    manifest['.lazy'] = lazy
+    # tables are not visible until the manifest is replaced
+    pickle.dump(manifest, open(filename + '.tmp', 'wb'))
+    os.replace(filename + '.tmp', filename)
+    files = set([x[0] for x in lazy.values()])
+    for x in os.listdir(folder):
+        if x not in files:
+            os.remove(os.path.join(folder, x))
+
+
+def load_db(filename):
+    return LazyDB(filename)
+
+
+class LazyDB(MutableMapping):
+    '''
+    Result database as a mapping of module name to table, where tables are
+    loaded from disk on first access. Databases saved as a single pickle by
+    previous versions of DSC are loaded as a whole.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = pickle.load(open(filename, 'rb'))
+        self.lazy = self.data.pop('.lazy', OrderedDict())
+        self.order = self.data.pop('.keys', list(self.data.keys()))
+        # columns to add to tables not loaded yet
+        self.defaults = dict()
+
+    def load(self, key):
+        from .dsc_io import load_ipc
+        filename, stamp, columns = self.lazy[key]
+        filename = os.path.join(get_db_tables(self.filename), filename)
+        if not os.path.isfile(filename):
+            raise DBError(
+                f"Cannot find table ``{key}`` of database ``{self.filename}``: ``{filename}`` is missing!"
+            )
+        if columns is None:
+            return open(filename).read()
+        value, metadata = load_ipc(filename)
+        if metadata.get('stamp') != stamp:
+            raise DBError(
+                f"Table ``{filename}`` does not match database ``{self.filename}``. Please rebuild the database."
+            )
+        for k, v in self.defaults.pop(key, dict()).items():
+            value[k] = v
+        return value
+
+    def __getitem__(self, key):
+        if key not in self.data:
+            if key not in self.lazy:
+                raise KeyError(key)
+            self.data[key] = self.load(key)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if key not in self.order:
+            self.order.append(key)
+        self.lazy.pop(key, None)
+        self.defaults.pop(key, None)
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        if key not in self.order:
+            raise KeyError(key)
+        self.order.remove(key)
+        self.lazy.pop(key, None)
+        self.defaults.pop(key, None)
+        self.data.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.order
+
+    def __iter__(self):
+        return iter(list(self.order))
+
+    def __len__(self):
+        return len(self.order)
+
+    def is_loaded(self, key):
+        return key in self.data
+
+    def get_columns(self, key):
+        '''Columns of a table, without loading it'''
+        if key in self.data:
+            return list(self.data[key].columns)
+        return self.lazy[key][2] + [
+            x for x in self.defaults.get(key, dict())
+            if x not in self.lazy[key][2]
+        ]
+
+    def add_column(self, key, column, value):
+        '''Add a column of constant value to a table, when it is loaded'''
+        if key in self.data:
+            self.data[key][column] = value
+        else:
+            self.defaults.setdefault(key, dict())[column] = value
+
+
+def list_to_tuple(value):
+    # values loaded from cache are lists
+    return tuple(value) if isinstance(value, list) else value
+
+
+def load_module_table(args):
+    '''Load parameters of a module in a separate process, see `ResultDB.load_module`'''
+    prefix, module, pipeline_modules, built, outputs = args
+    return ResultDB(prefix).load_module(module, pipeline_modules, built,
+                                        outputs)
 
 
 class ResultDB:
@@ -272,42 +779,36 @@ class ResultDB:
         self.prefix = prefix
         # data: every module is a table
         self.data = OrderedDict()
-        if os.path.isfile(f"{self.prefix}.map.mpk"):
-            self.maps = msgpack.unpackb(open(f"{self.prefix}.map.mpk",
-                                             "rb").read(),
-                                        encoding='utf-8',
-                                        object_pairs_hook=OrderedDict)
+        # map saved by previous versions of DSC is imported
+        if os.path.isfile(f"{self.prefix}.map.sqlite") or os.path.isfile(
+                f"{self.prefix}.map.mpk"):
+            self.maps = NameMap(f"{self.prefix}.map.sqlite")
         else:
             raise DBError(
-                f"Cannot build DSC meta-data: hash table ``{self.prefix}.map.mpk`` is missing!"
+                f"Cannot build DSC meta-data: hash table ``{self.prefix}.map.sqlite`` is missing!"
             )
         self.meta_kws = ['__id__', '__output__', '__parent__', '__out_vars__']
+        self.rawdata = None
 
-    def load_parameters(self):
-        #
-        def find_namemap(x):
-            if x in self.maps:
-                return self.maps[x][:-len_ext]
-            raise DBError('Cannot find name map for ``{}``'.format(x))
-
-        #
+    def load_parameters(self, built=None, outputs=False, jobs=1):
+        '''
+        Load parameters of module instances of every pipeline module, ie
+        instances of a module in a pipeline, to tables of modules, with
+        modules loaded in `jobs` processes. Results are in `self.chunks`:
+        {module: [(pipeline_module, digest, number of rows)]}, and in
+        `self.parts`: {module: (parts, output variables)}, see `load_module`.
+        built: {module: [(pipeline_module, digest, number of rows)]} of
+        previous build
+        outputs: also have modification time of output files in digest
+        '''
         try:
-            self.rawdata = msgpack.unpackb(open(
-                f'{DSC_CACHE}/{os.path.basename(self.prefix)}.io.mpk',
-                'rb').read(),
-                                           encoding='utf-8',
-                                           object_pairs_hook=OrderedDict)
-            self.metadata = msgpack.unpackb(open(
-                f'{DSC_CACHE}/{os.path.basename(self.prefix)}.io.meta.mpk',
-                'rb').read(),
-                                            encoding='utf-8',
-                                            object_pairs_hook=OrderedDict)
+            self.metadata = load_mpk_records(
+                f'{DSC_CACHE}/{os.path.basename(self.prefix)}.io.meta.mpk')
         except:
             raise DBError('Cannot load source data to build database!')
-        KWS = [
-            '__pipeline_id__', '__pipeline_name__', '__module__',
-            '__out_vars__'
-        ]
+        built = built or dict()
+        # pipeline modules of every module
+        modules = OrderedDict()
         seen = set()
         for workflow in self.metadata.values():
             for module in list(workflow.keys()):
@@ -315,49 +816,350 @@ class ResultDB:
                 if pipeline_module in seen:
                     continue
                 seen.add(pipeline_module)
-                data = self.rawdata[pipeline_module]
-                #
-                len_ext = len(data['__ext__']) + 1
-                for k, v in data.items():
-                    if k in ['__input_output___', '__ext__']:
-                        continue
-                    if module not in self.data:
-                        self.data[module] = dict([(x, [])
-                                                  for x in self.meta_kws])
-                        self.data[module]['__out_vars__'] = v['__out_vars__']
-                    # each v is a dict of a module instances
-                    # each key reads like
-                    # "shrink:a8bd873083994102:simulate:bd4946c8e9f6dcb6 simulate:bd4946c8e9f6dcb6"
-                    k = k.split(' ')
-                    # ID numbers all module instances
-                    num_parents = 1
-                    if len(k) > 1:
-                        # Have to fine its ID ...
-                        # see which module has __module_id__ == k[i] and return its ID
-                        num_parents = len(k[1:])
-                        self.data[module]['__parent__'].extend(k[1:])
-                    else:
-                        self.data[module]['__parent__'].append(None)
-                    # Assign other parameters
-                    self.data[module]['__output__'].extend(
-                        [find_namemap(k[0])] * num_parents)
-                    self.data[module]['__id__'].extend([k[0]] * num_parents)
-                    for kk, vv in v.items():
-                        if kk not in KWS:
-                            if kk not in self.data[module]:
-                                self.data[module][kk] = []
-                            self.data[module][kk].extend([remove_quotes(vv)] *
-                                                         num_parents)
-
-    def Build(self, script=None, groups=None, depends=None, pipelines=None):
-        self.load_parameters()
-        output = dict()
-        for module in self.data:
+                if module not in modules:
+                    modules[module] = []
+                modules[module].append(pipeline_module)
+        items = [(self.prefix, k, v, built.get(k, []), outputs)
+                 for k, v in modules.items()]
+        if jobs > 1 and len(items) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(
+                    max_workers=min(jobs, len(items))) as executor:
+                res = list(executor.map(load_module_table, items))
+        else:
+            res = [self.load_module(*x[1:]) for x in items]
+        self.chunks = OrderedDict()
+        self.parts = dict()
+        for module, (chunks, parts, out_vars) in zip(modules, res):
+            self.chunks[module] = chunks
+            self.parts[module] = (parts, out_vars)
+
+    def load_module(self, module, pipeline_modules, built=None, outputs=False):
+        '''
+        Load parameters of module instances of `pipeline_modules` of `module`.
+        Returns [(pipeline_module, digest, number of rows)]; parts of table of
+        the module, which are a data frame for consecutive new or changed
+        pipeline modules, or (start, end) of rows in table of previous build
+        for an unchanged one; and output variables of the module, None if
+        they are from previous build.
+        built: [(pipeline_module, digest, number of rows)] of previous build
+        '''
+        def find_namemap(x, maps):
+            if x in maps:
+                return maps[x][:-len_ext]
+            raise DBError('Cannot find name map for ``{}``'.format(x))
+
+        def get_digest(data, maps):
+            names = [
+                maps.get(k.split(' ')[0]) for k in data
+                if k not in ['__input_output___', '__ext__']
+            ]
+            if outputs:
+                dirname = os.path.dirname(self.prefix)
+                names.extend([
+                    os.stat(os.path.join(dirname, x)).st_mtime_ns
+                    if os.path.isfile(os.path.join(dirname, x)) else None
+                    for x in names if x is not None
+                ])
+            return xxh(msgpack.packb([data, names])).hexdigest()
+
+        def get_frame(table):
             cols = ['__id__', '__parent__', '__output__'] + [
-                x for x in self.data[module].keys() if x not in self.meta_kws
+                x for x in table.keys() if x not in self.meta_kws
             ]
-            output[module] = self.data[module].pop('__out_vars__')
-            self.data[module] = pd.DataFrame(self.data[module], columns=cols)
+            return pd.DataFrame(table, columns=cols)
+
+        #
+        if self.rawdata is None:
+            try:
+                # records of pipeline modules are loaded one at a time
+                self.rawdata = MpkRecords(
+                    f'{DSC_CACHE}/{os.path.basename(self.prefix)}.io.mpk')
+            except:
+                raise DBError('Cannot load source data to build database!')
+        KWS = [
+            '__pipeline_id__', '__pipeline_name__', '__module__',
+            '__out_vars__'
+        ]
+        offsets = dict()
+        start = 0
+        for pipeline_module, digest, rows in built or []:
+            offsets[(pipeline_module, digest)] = (start, start + rows)
+            start += rows
+        chunks = []
+        parts = []
+        # parameters of consecutive new pipeline modules are put together
+        table = None
+        out_vars = None
+        for idx, pipeline_module in enumerate(pipeline_modules):
+            data = self.rawdata[pipeline_module]
+            maps = self.maps.get_many([
+                k.split(' ')[0] for k in data
+                if k not in ['__input_output___', '__ext__']
+            ])
+            digest = get_digest(data, maps)
+            if (pipeline_module, digest) in offsets:
+                if table is not None:
+                    parts.append(get_frame(table))
+                    table = None
+                start, end = offsets[(pipeline_module, digest)]
+                chunks.append((pipeline_module, digest, end - start))
+                parts.append((start, end))
+                continue
+            if table is None:
+                table = dict([(x, []) for x in self.meta_kws])
+            if idx == 0:
+                out_vars = []
+            nrows = len(table['__id__'])
+            #
+            len_ext = len(data['__ext__']) + 1
+            for k, v in data.items():
+                if k in ['__input_output___', '__ext__']:
+                    continue
+                if idx == 0 and not out_vars:
+                    out_vars = v['__out_vars__']
+                # each v is a dict of a module instances
+                # each key reads like
+                # "shrink:a8bd873083994102:simulate:bd4946c8e9f6dcb6 simulate:bd4946c8e9f6dcb6"
+                k = k.split(' ')
+                # ID numbers all module instances
+                num_parents = 1
+                if len(k) > 1:
+                    # Have to fine its ID ...
+                    # see which module has __module_id__ == k[i] and return its ID
+                    num_parents = len(k[1:])
+                    table['__parent__'].extend(k[1:])
+                else:
+                    table['__parent__'].append(None)
+                # Assign other parameters
+                table['__output__'].extend([find_namemap(k[0], maps)] *
+                                           num_parents)
+                table['__id__'].extend([k[0]] * num_parents)
+                for kk, vv in v.items():
+                    if kk not in KWS:
+                        if kk not in table:
+                            table[kk] = []
+                        table[kk].extend([remove_quotes(vv)] * num_parents)
+            chunks.append(
+                (pipeline_module, digest, len(table['__id__']) - nrows))
+        if table is not None:
+            parts.append(get_frame(table))
+        return chunks, parts, out_vars
+
+    def get_table(self, module, previous=None):
+        '''
+        Make table of a module from its parts in `self.parts`, taking rows of
+        unchanged pipeline modules from table of previous build.
+        Return table and output variables of the module.
+        '''
+        parts, out_vars = self.parts[module]
+        if out_vars is None:
+            out_vars = previous['.output'][module]
+        tables = [
+            previous[module].iloc[slice(*x)] if isinstance(x, tuple) else x
+            for x in parts
+        ]
+        if len(tables) > 1:
+            res = pd.concat(tables, ignore_index=True, sort=False)
+        else:
+            res = tables[0].reset_index(drop=True)
+        if previous is not None:
+            # values of output variables are loaded again for all rows
+            res = res.drop(columns=[
+                x for x in previous.get('.materialized', dict()).get(
+                    module, []) if x in res.columns
+            ])
+        return res, out_vars
+
+    def load_previous(self, materialize=False, timing=False):
+        '''
+        Database of previous build, if it can be updated incrementally
+        '''
+        from .version import __version__
+        filename = self.prefix + '.db'
+        if not os.path.isfile(filename):
+            return None
+        try:
+            previous = load_db(filename)
+        except Exception:
+            return None
+        build = previous.get('.build', None)
+        if build is None or build != dict(build,
+                                          version=__version__,
+                                          materialize=materialize,
+                                          timing=timing):
+            return None
+        return previous
+
+    def load_outputs(self, modules, jobs=1):
+        '''
+        Load values of output variables from output files of module instances.
+        modules: {module: [variables]}
+        Return {module: {variable: values}}, with values aligned to rows of
+        module tables; values are None for missing files.
+        '''
+        from .dsc_io import load_dsc_scalars
+        from .query_cache import OutputCache
+        dirname = os.path.dirname(self.prefix)
+        cache = OutputCache(
+            os.path.join(dirname, '.query_cache', 'outputs.sqlite'))
+        # output file: (path, mtime, variables)
+        files = dict()
+        for module in modules:
+            for x in self.data[module]['__output__']:
+                if x in files:
+                    continue
+                path = os.path.join(dirname, x)
+                path = path + '.rds' if os.path.isfile(path +
+                                                       '.rds') else path + '.pkl'
+                if os.path.isfile(path):
+                    files[x] = (path, os.stat(path).st_mtime_ns,
+                                modules[module])
+        values = cache.get(
+            dict([(path, (mtime, keys))
+                  for path, mtime, keys in files.values()]))
+        items = [(path, sorted(set(keys) - set(values.get(path, dict()))))
+                 for path, mtime, keys in files.values()]
+        items = [x for x in items if len(x[1])]
+        if len(items):
+            if jobs > 1 and len(items) > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    loaded = list(
+                        executor.map(load_dsc_scalars,
+                                     items,
+                                     chunksize=max(
+                                         len(items) // (jobs * 4), 1)))
+            else:
+                loaded = [load_dsc_scalars(x) for x in items]
+            new_values = dict()
+            for (path, keys), res in zip(items, loaded):
+                if res is None:
+                    continue
+                values.setdefault(path, dict()).update(res)
+                new_values[path] = (os.stat(path).st_mtime_ns, res)
+            if len(new_values):
+                cache.put(new_values)
+        res = dict()
+        for module in modules:
+            res[module] = dict()
+            for var in modules[module]:
+                res[module][var] = [
+                    values.get(files[x][0], dict()).get(var, (True, None))
+                    if x in files else (True, None)
+                    for x in self.data[module]['__output__']
+                ]
+        return res
+
+    def get_output_vars(self, output):
+        '''
+        Output variables of modules that can be added to module tables:
+        those not of the same name as a parameter.
+        '''
+        return dict([(module, [
+            x for x in output[module]
+            if x not in self.data[module] and not x.startswith('DSC_')
+        ]) for module in self.data if module in output])
+
+    def materialize_outputs(self, values):
+        '''
+        Add scalar and short vector values of module output variables to
+        module tables, so that they can be queried as parameters are.
+        values: output of `load_outputs`
+        '''
+        materialized = dict()
+        for module in values:
+            for var, value in values[module].items():
+                if var.startswith('DSC_'):
+                    continue
+                if not all([x[0] for x in value]) or all(
+                    [x[1] is None for x in value]):
+                    # some are not scalars, or none is available
+                    continue
+                self.data[module][var] = pd.Series(
+                    [list_to_tuple(x[1]) for x in value],
+                    index=self.data[module].index).infer_objects()
+                materialized.setdefault(module, []).append(var)
+        return materialized
+
+    def add_debug_info(self, values):
+        '''
+        Add elapsed time and replicate of module instances, saved in
+        `DSC_DEBUG` of their output, to module tables as columns `DSC_TIME`
+        and `__replicate__`.
+        values: output of `load_outputs`
+        '''
+        for module in values:
+            for var, col in [('DSC_TIME', 'DSC_TIME'),
+                             ('DSC_REPLICATE', '__replicate__')]:
+                if var not in values[module]:
+                    continue
+                self.data[module][col] = pd.to_numeric(pd.Series(
+                    [x[1] if x[0] else None for x in values[module][var]],
+                    index=self.data[module].index,
+                    dtype=object),
+                                                       errors='coerce')
+
+    def Build(self,
+              script=None,
+              groups=None,
+              depends=None,
+              pipelines=None,
+              sqlite=False,
+              materialize=False,
+              timing=False,
+              jobs=1):
+        from .version import __version__
+        # only pipeline modules new or changed since previous build are loaded
+        previous = self.load_previous(materialize, timing)
+        built = previous['.build']['chunks'] if previous is not None else None
+        self.load_parameters(built, materialize or timing, jobs)
+        if previous is not None:
+            self.data = previous
+            for module in [
+                    x for x in previous
+                    if x not in self.chunks and x in previous.lazy
+            ]:
+                del self.data[module]
+        output = dict()
+        changed = []
+        for module in self.chunks:
+            if built is not None and module in built and [
+                    x[:2] for x in self.chunks[module]
+            ] == [x[:2] for x in built[module]]:
+                output[module] = previous['.output'][module]
+                continue
+            changed.append(module)
+            self.data[module], output[module] = self.get_table(
+                module, previous)
+        if materialize or timing:
+            # output files are read once for both
+            modules = self.get_output_vars(
+                dict([(k, output[k])
+                      for k in changed])) if materialize else dict()
+            if timing:
+                for module in changed:
+                    modules[module] = modules.get(
+                        module, []) + ['DSC_TIME', 'DSC_REPLICATE']
+            values = self.load_outputs(modules, jobs)
+            if materialize:
+                materialized = dict([
+                    (k, v) for k, v in (
+                        previous.get('.materialized', dict()) if previous
+                        is not None else dict()).items()
+                    if k in self.chunks and k not in changed
+                ])
+                materialized.update(self.materialize_outputs(values))
+                self.data['.materialized'] = materialized
+            if timing:
+                self.add_debug_info(values)
+        for module in changed:
+            self.data[module] = set_column_types(self.data[module])
+        self.data['.build'] = dict(
+            version=__version__,
+            materialize=materialize,
+            timing=timing,
+            chunks=dict(self.chunks))
         if script is not None:
             self.data['.html'] = script
         if groups is not None:
@@ -366,7 +1168,12 @@ class ResultDB:
             self.data['.depends'] = depends
         self.data['.output'] = output
         self.data['.pipelines'] = pipelines
-        pickle.dump(self.data, open(self.prefix + '.db', 'wb'))
+        save_db(self.data, self.prefix + '.db')
+        if sqlite:
+            write_sqlite_db(self.data, self.prefix + '.sqlite')
+        elif os.path.isfile(self.prefix + '.sqlite'):
+            # do not leave behind a database that is out of sync
+            os.remove(self.prefix + '.sqlite')
 
 
 if __name__ == '__main__':
@@ -10,23 +10,21 @@ python -m 'rpy2.tests'
 
 from dsc.utils import flatten_list
 
+# vectors of at most this length are kept as a whole in a table cell
+SHORT_VECTOR_LENGTH = 10
+
 
 def load_mpk(mpk_files, jobs=2):
-    import msgpack, collections
+    import collections
     from multiprocessing import Process, Manager
-    from .utils import chunks
+    from .utils import chunks, load_mpk_records
     if isinstance(mpk_files, str):
-        return msgpack.unpackb(open(mpk_files, "rb").read(),
-                               encoding='utf-8',
-                               object_pairs_hook=collections.OrderedDict)
+        return load_mpk_records(mpk_files)
     d = Manager().dict()
 
     def f(d, x):
         for xx in x:
-            d.update(
-                msgpack.unpackb(open(xx, "rb").read(),
-                                encoding='utf-8',
-                                object_pairs_hook=collections.OrderedDict))
+            d.update(load_mpk_records(xx))
 
     #
     mpk_files = [x for x in chunks(mpk_files, int(len(mpk_files) / jobs) + 1)]
@@ -234,6 +232,186 @@ def convert_dsc(pkl_files, jobs=2):
     return 0
 
 
+def get_dsc_time(debug):
+    '''Elapsed time of a module instance from its `DSC_DEBUG` entry'''
+    import collections
+    time = debug.get('time', None)
+    if isinstance(time, collections.abc.Mapping):
+        time = time.get('elapsed', None)
+    return as_scalar(time)[1]
+
+
+def as_scalar(value, max_length=1):
+    '''
+    Return (True, value) if value can be stored in a table cell,
+    (False, None) otherwise. Length one vectors are scalars; vectors of
+    scalars no longer than `max_length` are stored as tuples.
+    '''
+    import numpy as np
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return True, value
+    if isinstance(value, np.generic):
+        return True, value.item()
+    if isinstance(value, (dict, bytes)) or not hasattr(value, '__len__'):
+        return False, None
+    if isinstance(value, np.ndarray):
+        if value.ndim > 1 and value.size > 1:
+            return False, None
+        value = value.ravel()
+    if len(value) == 0 or len(value) > max_length:
+        return False, None
+    try:
+        value = [as_scalar(x) for x in value]
+    except TypeError:
+        return False, None
+    if not all([x[0] for x in value]):
+        return False, None
+    if len(value) == 1:
+        return value[0]
+    return True, tuple([x[1] for x in value])
+
+
+def load_dsc_scalars(item):
+    '''
+    Load variables from a DSC output file.
+    item: (filename, keys)
+    Return key: (is scalar, value) for each key, where short vectors are
+    tuples (see `as_scalar`); `DSC_TIME` and `DSC_REPLICATE` are elapsed time
+    and replicate of the module instance. Missing file gives None.
+    '''
+    filename, keys = item
+    try:
+        data = load_dsc(filename)
+    except Exception:
+        return None
+    res = dict()
+    for k in keys:
+        if k == 'DSC_TIME':
+            res[k] = (True, get_dsc_time(data.get('DSC_DEBUG', dict())))
+        elif k == 'DSC_REPLICATE':
+            res[k] = as_scalar(
+                data.get('DSC_DEBUG', dict()).get('replicate', None))
+        elif k in data:
+            res[k] = as_scalar(data[k], SHORT_VECTOR_LENGTH)
+    return res
+
+
+def encode_table(data, metadata=None):
+    '''
+    Convert a DataFrame to Arrow table.
+    Object columns mixing values of different types (eg numbers and "NA")
+    cannot be stored in a column of Arrow table; they are saved as `repr` of
+    values and recovered in `decode_table`.
+    '''
+    import json
+    import pandas as pd, pyarrow as pa
+    data = pd.DataFrame(data)
+    encoded = []
+    columns = dict()
+    for k in data.columns:
+        if data[k].dtype == object and pd.api.types.infer_dtype(
+                data[k], skipna=False) not in ['string', 'empty']:
+            columns[k] = data[k].map(repr)
+            encoded.append(k)
+        else:
+            columns[k] = data[k]
+    table = pa.Table.from_pandas(pd.DataFrame(columns, index=data.index),
+                                 preserve_index=False)
+    metadata = dict(metadata or dict())
+    metadata['dsc_repr_columns'] = encoded
+    return table.replace_schema_metadata({
+        **(table.schema.metadata or dict()), b'dsc':
+        json.dumps(metadata).encode()
+    })
+
+
+def decode_table(table):
+    '''Convert Arrow table made by `encode_table` to DataFrame and metadata'''
+    import json, ast
+
+    def literal(x):
+        try:
+            return ast.literal_eval(x)
+        except (ValueError, SyntaxError):
+            return float(x) if x in ['nan', 'inf', '-inf'] else x
+
+    metadata = json.loads((table.schema.metadata
+                           or dict()).get(b'dsc', b'{}').decode())
+    data = table.to_pandas()
+    for k in metadata.pop('dsc_repr_columns', []):
+        if k in data.columns:
+            data[k] = data[k].map(literal).astype(object)
+    return data, metadata
+
+
+def save_parquet(data, filename, metadata=None):
+    '''Save a DataFrame to parquet file, see `encode_table`'''
+    import pyarrow.parquet as pq
+    pq.write_table(encode_table(data, metadata), filename)
+
+
+def load_parquet(filename, columns=None):
+    '''Load DataFrame saved by `save_parquet`, and its metadata'''
+    import pyarrow.parquet as pq
+    return decode_table(pq.read_table(filename, columns=columns))
+
+
+def save_ipc(data, filename, metadata=None):
+    '''
+    Save a DataFrame to uncompressed Arrow IPC file, which can be memory
+    mapped when loaded. See `encode_table`.
+    '''
+    import pyarrow.feather as pf
+    pf.write_feather(encode_table(data, metadata),
+                     filename,
+                     compression='uncompressed')
+
+
+def load_ipc(filename, columns=None):
+    '''Load DataFrame saved by `save_ipc`, and its metadata'''
+    import pyarrow.feather as pf
+    return decode_table(
+        pf.read_table(filename, columns=columns, memory_map=True))
+
+
+ARROW_EXTENSIONS = ['.parquet', '.feather', '.arrow']
+
+
+def save_arrow(data, filename):
+    '''
+    Save a query result table to parquet or Arrow IPC (feather) file,
+    by extension of filename. Unlike `save_parquet` the file is meant to be
+    read by other programs: "NA" is saved as missing value, and object
+    columns that are not numbers are saved as text.
+    '''
+    import pandas as pd, pyarrow as pa
+    columns = dict()
+    for k in data.columns:
+        if data[k].dtype != object:
+            columns[k] = data[k]
+            continue
+        value = data[k].map(lambda x: None
+                            if x is None or (isinstance(x, str) and x == 'NA')
+                            else x)
+        if value.isnull().all():
+            columns[k] = value.astype(object)
+            continue
+        numeric = pd.to_numeric(value, errors='coerce')
+        if numeric.isnull().equals(value.isnull()):
+            columns[k] = numeric
+        else:
+            columns[k] = value.map(lambda x: x if x is None or isinstance(
+                x, str) else str(x)).astype(object)
+    table = pa.Table.from_pandas(pd.DataFrame(columns, index=data.index),
+                                 preserve_index=False)
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        pq.write_table(table, filename)
+    else:
+        import pyarrow.feather as pf
+        pf.write_feather(table, filename)
+
+
 def symlink_force(target, link_name):
     import os, errno
     try:
@@ -476,17 +476,17 @@ class DSC_Script:
                 )
         self.content.update(res)
 
-    def init_dsc(self, env):
+    @staticmethod
+    def init_dsc(output, env):
         os.makedirs(DSC_CACHE, exist_ok=True)
-        if os.path.dirname(self.runtime.output):
-            os.makedirs(os.path.dirname(self.runtime.output), exist_ok=True)
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
         if env.verbosity > 2:
-            env.logfile = os.path.basename(self.runtime.output) + '.log'
+            env.logfile = os.path.basename(output) + '.log'
             if os.path.isfile(env.logfile):
                 os.remove(env.logfile)
-        if os.path.isfile(
-                os.path.basename(self.runtime.output) + '.scripts.html'):
-            os.remove(os.path.basename(self.runtime.output) + '.scripts.html')
+        if os.path.isfile(os.path.basename(output) + '.scripts.html'):
+            os.remove(os.path.basename(output) + '.scripts.html')
         update_gitconf()
 
     def dump(self):
@@ -662,6 +662,8 @@ class DSC_Module:
         self.libpath_tracked = None
         self.rlib = None
         self.pymodule = None
+        # number of instances to run in one process
+        self.batch = 1
         # dependencies
         self.depends = []
         # check if it runs in shell
@@ -669,6 +671,11 @@ class DSC_Module:
         self.set_options(global_options,
                          try_get_value(content, ('meta', 'conf')))
         self.set_exec(content['meta']['exec'])
+        if self.batch > 1 and (len(self.exe['path'])
+                               or self.exe['type'] not in ['R', 'PY']):
+            raise FormatError(
+                f"@CONF option ``batch`` of module ``{self.name}`` only applies to R or Python scripts."
+            )
         self.set_input(try_get_value(content, 'input'),
                        try_get_value(content, ('meta', 'alias')))
         self.set_output(content['output'])
@@ -916,6 +923,12 @@ class DSC_Module:
         self.rlib = try_get_value(spec_option, 'R_libs', [])
         self.pymodule = try_get_value(spec_option, 'python_modules', [])
         self.libpath_tracked = libpath2
+        batch = try_get_value(spec_option, 'batch', ['1'])
+        if len(batch) != 1 or not str(batch[0]).isdigit() or int(batch[0]) < 1:
+            raise FormatError(
+                f"@CONF option ``batch`` of module ``{self.name}`` should be a positive integer, not ``{', '.join(map(str, batch))}``."
+            )
+        self.batch = int(batch[0])
 
     def set_input(self, params, alias):
         if params is not None:
@@ -6,16 +6,16 @@ __license__ = "MIT"
 '''
 This file defines methods to translate DSC into pipeline in SoS language
 '''
-import os, sys, msgpack, glob, inspect
+import os, sys, glob, inspect
 try:
     from xxhash import xxh32 as xxh
 except ImportError:
     from hashlib import md5 as xxh
 from collections import OrderedDict
 from sos.targets import path
-from .utils import uniq_list, dict2str, n2a, load_io_db, install_package
+from .utils import uniq_list, dict2str, n2a, load_io_db, dump_mpk_records, install_package
 from .syntax import DSC_CACHE
-__all__ = ['DSC_Translator']
+__all__ = ['DSC_Translator', 'TranslationCache']
 
 class DSC_Translator:
     '''
@@ -30,7 +30,9 @@ class DSC_Translator:
                  n_cpu=4,
                  try_catch=False,
                  host_conf=None,
-                 debug=False):
+                 debug=False,
+                 build_options=None,
+                 python_workers=False):
         # FIXME: to be replaced by the R utils package
         self.output = runtime.output
         self.db = os.path.basename(runtime.output)
@@ -75,7 +77,8 @@ class DSC_Translator:
                             if x == step.name
                     ]) == 0:
                         job_translator = self.Step_Translator(
-                            step, self.db, None, try_catch, host_conf, debug)
+                            step, self.db, None, try_catch, host_conf, debug,
+                            python_workers)
                         job_str.append(job_translator.dump())
                         job_translator.clean()
                         exe_signatures[
@@ -136,12 +139,13 @@ class DSC_Translator:
                 self.job_pool[(y, workflow_id + 1)] = tmp_str
                 ii += 1
         conf_str_py = 'import msgpack\nfrom collections import OrderedDict\n' + \
-                      'from dsc.utils import sos_hash_output, sos_group_input, chunks as sos_chunks\n' + \
+                      'from dsc.utils import sos_hash_output, sos_group_input, chunks as sos_chunks, MpkRecordsWriter\n' + \
                       '\n'.join([f'## {x}' for x in dict2str(self.step_map).split('\n')]) + \
                       '@profile #via "kernprof -l" and "python -m line_profiler"\ndef prepare_io():\n\t'+ \
-                      f'\n\t__io_db__ = OrderedDict()\n\t' + \
-                      '\n\t'.join('\n'.join(conf_str).split('\n')) + \
-                      f"\n\topen('{DSC_CACHE}/{self.db}.io.mpk', 'wb').write(msgpack.packb(__io_db__))\n\n" + \
+                      "\n\t# every module of a pipeline is written to disk once configured\n\t" + \
+                      f"with MpkRecordsWriter('{DSC_CACHE}/{self.db}.io.mpk') as __io_db__:\n\t\t" + \
+                      '\n\t\t'.join('\n'.join(conf_str).split('\n')) + \
+                      "\n\n" + \
                       "if __name__ == '__main__':\n\tprepare_io()"
         self.job_str = job_header + "\n{}".format('\n'.join(job_str))
         self.conf_str_sos = conf_header + \
@@ -154,15 +158,16 @@ class DSC_Translator:
                             "\n[deploy_2 (Configuring output filenames)]\n"\
                             f"parameter: vanilla = {rerun}\n"\
                             f"input: '{DSC_CACHE}/{self.db}.io.mpk'\n"\
-                            f"output: '{self.output}/{self.db}.map.mpk', "\
+                            f"output: '{self.output}/{self.db}.map.sqlite', "\
                             f"'{self.output}/{self.db}.conf.mpk'"\
                             "\nbuild_config_db(str(_input[0]), str(_output[0]), "\
                             f"str(_output[1]), vanilla = vanilla, jobs = {n_cpu})\n"\
                             "\n[build (Build meta-database)]\n"\
-                            f"depends: '{DSC_CACHE}/{self.db}.io.mpk', '{self.output}/{self.db}.map.mpk'\n"\
+                            f"depends: '{DSC_CACHE}/{self.db}.io.mpk', '{self.output}/{self.db}.map.sqlite'\n"\
                             f"output: '{self.output}/{self.db}.db'"\
                             "\nResultDB(f'{_output:n}')."\
-                            f"Build(script = open('{runtime.output}.html').read(), groups = {runtime.groups}, depends = {self.get_dependency()}, pipelines = {runtime.sequence})"
+                            f"Build(script = open('{runtime.output}.html').read(), groups = {runtime.groups}, depends = {self.get_dependency()}, pipelines = {runtime.sequence}" + \
+                            ''.join([f", {k} = {repr(v)}" for k, v in (build_options or dict()).items()]) + ")"
         #
         self.install_libs(runtime.rlib, "R_library")
         self.install_libs([x for x in runtime.pymodule if x != 'dsc'],
@@ -171,8 +176,8 @@ class DSC_Translator:
     def get_pipeline(self, task, save=False):
         if task == 'prepare':
             res = self.conf_str_sos
-            open(f'{DSC_CACHE}/{self.db}.io.meta.mpk',
-                 'wb').write(msgpack.packb(self.step_map))
+            dump_mpk_records(f'{DSC_CACHE}/{self.db}.io.meta.mpk',
+                             self.step_map.items())
         else:
             res = self.job_str
         # clean up previous runs
@@ -252,7 +257,8 @@ class DSC_Translator:
                      step_map,
                      try_catch,
                      host_conf=None,
-                     debug=False):
+                     debug=False,
+                     python_workers=False):
             '''
             prepare step:
              - will produce source to build config and database for
@@ -260,7 +266,8 @@ class DSC_Translator:
             with keys "X:Y:Z" where X = DSC sequence ID, Y = DSC subsequence ID, Z = DSC step name
                 (name of indexed DSC block corresponding to a computational routine).
             run step:
-             - will construct the actual script to run
+             - will construct the actual script to run, of Python modules
+            in a pool of Python workers if `python_workers` is set
             '''
             # FIXME
             #if step_map is not None and len(step.rf.values()) > 1:
@@ -277,6 +284,7 @@ class DSC_Translator:
             self.db = db
             self.conf = host_conf
             self.debug = debug
+            self.python_workers = python_workers
             self.input_vars = None
             self.header = ''
             self.loop_string = ['', '']
@@ -346,7 +354,9 @@ class DSC_Translator:
                         f'group_by = {len(self.current_depends)}')
                 else:
                     self.input_string += "input:"
-                if len(self.params):
+                if self.step.batch > 1:
+                    self.get_batch_input()
+                elif len(self.params):
                     if self.filter_string:
                         self.input_option.append("for_each = {{'{0}':[({0}) {1}{2}]}}".\
                                                  format(','.join([f'_{x}' for x in self.params]),
@@ -356,6 +366,29 @@ class DSC_Translator:
                         self.input_option.append(
                             f'for_each = {repr(self.params)}')
 
+        def get_batch_input(self):
+            '''
+            Make every substep a batch of module instances, listed in the same
+            order as output files are: parameters vary slower than input
+            '''
+            n_input = len(self.current_depends)
+            instance_string = 'DSC_INSTANCES_ = [(dict([{0}]), __i__) {1} for __i__ in range({2})]'.\
+                              format(', '.join([f"('_{x}', _{x})" for x in self.params]),
+                                     self.loop_string[0] + self.filter_string,
+                                     f'len({self.step.name}_input_files) // {n_input}' if n_input else 1)
+            batch_string = 'DSC_BATCHES_ = [list(range(i, min(i + {0}, len(DSC_INSTANCES_)))) ' \
+                           'for i in range(0, len(DSC_INSTANCES_), {0})]'.format(self.step.batch)
+            self.input_string = self.input_string.replace(
+                'input:', f'{instance_string}\n{batch_string}\ninput:')
+            if n_input:
+                # input of a batch by file names because `dynamic` sorts files
+                self.input_option = [
+                    f'group_by = lambda x: [sorted(set(f for i in b for f in {self.get_batch_input_files()})) '
+                    'for b in DSC_BATCHES_]'
+                ]
+            else:
+                self.input_option.append("for_each = {'DSC_BATCH_': DSC_BATCHES_}")
+
         def get_output(self):
             if self.prepare:
                 format_string = '.format({})'.format(', '.join([
@@ -376,6 +409,8 @@ class DSC_Translator:
                 else:
                     self.output_string += "\n{0} = ['{1}:{{}}'.format(item) for item in {0}]".\
                                           format(output_lhs, self.step.name)
+            elif self.step.batch > 1:
+                self.output_string += f"output: [{self.step.name}_output_files[i] for i in DSC_BATCHES_[_index]]"
             else:
                 self.output_string += f"output: {self.step.name}_output_files[_index]"
 
@@ -411,17 +446,19 @@ class DSC_Translator:
                 for idx, (plugin, cmd) in enumerate(
                         zip([self.step.plugin], [self.step.exe])):
                     sigil = '$[ ]' if plugin.name == 'bash' else '${ }'
+                    interpreter = "python3" if plugin.name == "python" else plugin.name
+                    action = f'{interpreter}: expand = "{sigil}"'
+                    workdir = '' if self.conf is not None or path(
+                        self.step.workdir).absolute() == path.cwd(
+                        ) else f", workdir = {repr(self.step.workdir)}"
                     if self.conf is None:
-                        self.action += f'{"python3" if plugin.name == "python" else plugin.name}: expand = "{sigil}"'
-                        if path(self.step.workdir).absolute() != path.cwd():
-                            self.action += f", workdir = {repr(self.step.workdir)}"
-                        self.action += f', stderr = f"{{_output:n}}.stderr", stdout = f"{{_output:n}}.stdout"'
-                    else:
-                        self.action += f'{"python3" if plugin.name == "python" else plugin.name}: expand = "{sigil}"'
-                    self.action += plugin.get_cmd_args(cmd['args'],
-                                                       self.params)
+                        action += workdir
+                        action += f', stderr = f"{{_output:n}}.stderr", stdout = f"{{_output:n}}.stdout"'
+                    action += plugin.get_cmd_args(cmd['args'], self.params)
                     # Add action
                     if len(cmd['path']) == 0:
+                        run_in_worker = self.python_workers and plugin.name == 'python' \
+                            and self.conf is None and not cmd['args']
                         if self.debug:
                             script = plugin.get_return(None)
                         else:
@@ -447,14 +484,38 @@ class DSC_Translator:
                                 script = plugin.add_try(
                                     script, len([self.step.rf.values()]))
                             script = f"""## {str(plugin)} script UUID: ${{DSC_STEP_ID_}}\n{script}\n"""
-                            script = '\n'.join(
-                                [f'  {x}' for x in script.split('\n')])
-                        self.action += script
+                            if self.step.batch == 1 and not run_in_worker:
+                                script = '\n'.join(
+                                    [f'  {x}' for x in script.split('\n')])
+                        if self.step.batch > 1 or run_in_worker:
+                            # script of every instance is expanded from this template
+                            if self.step.batch > 1:
+                                instances = f"[dict(DSC_INSTANCES_[i][0], _output = {self.step.name}_output_files[i], " \
+                                            f"_input = {self.get_batch_input_files()}, DSC_STEP_ID_ = DSC_STEP_ID_) " \
+                                            f"for i in DSC_BATCHES_[_index]]"
+                            else:
+                                instances = "[dict([{}], _output = _output, _input = _input, DSC_STEP_ID_ = DSC_STEP_ID_)]".\
+                                            format(', '.join([f"('_{x}', _{x})" for x in self.params]))
+                            if run_in_worker:
+                                action = f"from dsc.dsc_worker import sos_run_worker\nDSC_SCRIPT_ = {repr(script)}\n" \
+                                         f"sos_run_worker(DSC_SCRIPT_, {instances}{workdir})\n"
+                            else:
+                                action = f"from dsc.utils import sos_batch_script\nDSC_SCRIPT_ = {repr(script)}\n" \
+                                         f"{interpreter}(sos_batch_script(DSC_SCRIPT_, {repr(plugin.name)}, " \
+                                         f"{instances}){workdir})\n"
+                            script = ''
+                        self.action += action + script
                         self.exe_signature.append(cmd['signature'])
                     else:
                         self.exe_check.append(
                             f"executable({repr(cmd['path'])})")
-                        self.action += f"\t{cmd['path']} {'$*' if cmd['args'] else ''}\n"
+                        self.action += action + f"\t{cmd['path']} {'$*' if cmd['args'] else ''}\n"
+
+        def get_batch_input_files(self):
+            n_input = len(self.current_depends)
+            if n_input == 0:
+                return '[]'
+            return f'{self.step.name}_input_files[{n_input} * DSC_INSTANCES_[i][1]:{n_input} * (DSC_INSTANCES_[i][1] + 1)]'
 
         def dump(self):
             return '\n'.join([
@@ -462,9 +523,107 @@ class DSC_Translator:
                     self.header,
                     self.param_string.strip(), ' '.join([
                         self.input_string,
-                        (', ' if self.input_string != 'input:' else '') +
+                        (', ' if not self.input_string.endswith('input:') else '') +
                         ', '.join(self.input_option)
                     ]) if not self.prepare else self.input_string,
                     self.output_string, self.step_option, self.action
                 ] if x
             ])
+
+
+class TranslationCache:
+    '''
+    Translation of DSC script saved from previous run, to be reused when
+    neither DSC script (with files it includes), module scripts, command
+    options nor DSC version has changed.
+    '''
+    def __init__(self, dsc_file, options):
+        from .dsc_parser import DSC_Script
+        from .version import __version__
+        self.filename = f'{DSC_CACHE}/{xxh(os.path.abspath(dsc_file)).hexdigest()}.translation.pkl'
+        self.key = xxh(
+            repr([
+                __version__, sys.executable,
+                DSC_Script.load_dsc(dsc_file), options
+            ])).hexdigest()
+
+    def load(self):
+        '''Saved translation, or None if it is out of date'''
+        import pickle
+        from sos.targets import fileMD5
+        if not os.path.isfile(self.filename):
+            return None
+        try:
+            with open(self.filename, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            return None
+        if data['key'] != self.key:
+            return None
+        for pattern, files in data['patterns'].items():
+            if sorted(glob.glob(pattern)) != files:
+                return None
+        for fn, signature in data['files'].items():
+            if (fileMD5(fn) if os.path.isfile(fn) else None) != signature:
+                return None
+        # module scripts found elsewhere, eg in another "exec_path" folder
+        for item, path, fn in data['located']:
+            if self.locate(item, path) != fn:
+                return None
+        return data['value']
+
+    @staticmethod
+    def locate(item, path):
+        '''Module script, or else executable, `item` as found with "exec_path" `path`'''
+        import platform, shutil
+        from .utils import locate_file
+        if isinstance(path, str):
+            path = [path]
+        try:
+            fn = locate_file(item, path)
+        except ValueError:
+            # found in several folders
+            return ''
+        if fn is not None:
+            return os.path.abspath(fn)
+        dirs = [
+            os.path.join(x, 'mac' if platform.system() == 'Darwin' else 'linux')
+            for x in path or []
+        ] + list(path or [])
+        return shutil.which(item,
+                            path=os.pathsep.join(
+                                dirs + [os.environ.get('PATH', os.defpath)]))
+
+    def save(self, script, value, files=None, patterns=None):
+        '''
+        Save translation `value` of parsed `script`, along with signatures
+        of `files` and module scripts it depends on. Lists of files matching
+        `patterns` have to be the same for translation to be reused.
+        '''
+        import pickle
+        from sos.targets import fileMD5
+        files = list(files or [])
+        patterns = list(patterns or [])
+        located = []
+        for module in script.modules.values():
+            for item in module.exe['file']:
+                item = item.split('@')[-1]
+                located.append((item, module.path, self.locate(item, module.path)))
+                files.append(located[-1][2] or None)
+            for x in module.libpath_tracked or []:
+                patterns.extend([
+                    os.path.join(os.path.expanduser(x), f'*.{ext}')
+                    for ext in uniq_list(
+                        [module.exe['type'], module.exe['type'].lower()])
+                ])
+        patterns = dict([(x, sorted(glob.glob(x))) for x in uniq_list(patterns)])
+        files = uniq_list(files + sum(patterns.values(), []))
+        data = dict(key=self.key,
+                    patterns=patterns,
+                    located=located,
+                    files=dict([(x, fileMD5(x) if os.path.isfile(x) else None)
+                                for x in files if x is not None]),
+                    value=value)
+        with open(self.filename + '.tmp', 'wb') as f:
+            pickle.dump(data, f)
+        os.replace(self.filename + '.tmp', self.filename)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+__author__ = "Gao Wang"
+__copyright__ = "Copyright 2016, Stephens lab"
+__email__ = "gaow@uchicago.edu"
+__license__ = "MIT"
+'''
+Pool of long-lived local Python processes running instances of Python
+modules, so that libraries are imported once per process rather than once
+per module instance.
+'''
+import os, sys
+
+WORKER_ADDRESS = 'DSC_WORKER_ADDRESS'
+WORKER_AUTHKEY = 'DSC_WORKER_AUTHKEY'
+
+
+def run_instance(script, output, workdir=None):
+    '''
+    Run `script` of a module instance in a fresh namespace, with stdout and
+    stderr written to files next to `output`. Return error message or None.
+    '''
+    import linecache, runpy, traceback
+    cwd = os.getcwd()
+    path = list(sys.path)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    error = None
+    with open(output + '.stdout', 'w') as stdout, open(output + '.stderr',
+                                                       'w') as stderr:
+        # redirect file descriptors to also capture output of compiled code
+        os.dup2(stdout.fileno(), 1)
+        os.dup2(stderr.fileno(), 2)
+        try:
+            if workdir:
+                os.chdir(workdir)
+            runpy.run_path(script, run_name='__main__')
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = f'exit code {e.code}'
+        except BaseException as e:
+            traceback.print_exc()
+            error = traceback.format_exception_only(type(e), e)[-1].strip()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.chdir(cwd)
+            sys.path[:] = path
+            linecache.clearcache()
+    for fd in saved:
+        os.close(fd)
+    return error
+
+
+def worker_main(conn):
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        scripts, outputs, workdir = job
+        error = None
+        for script, output in zip(scripts, outputs):
+            error = run_instance(script, output, workdir)
+            if error:
+                error = f"Failed to run module instance ``{output}`` ({error}), see ``{output}.stderr`` for details."
+                break
+        conn.send(error)
+
+
+class WorkerPool:
+    '''
+    Start `n` Python worker processes, and serve jobs of `sos_run_worker`
+    submitted by SoS substeps over a local socket, whose address is passed
+    to them via environment variables.
+    '''
+    def __init__(self, n):
+        import multiprocessing, queue, secrets, tempfile, threading
+        from multiprocessing.connection import Listener
+        # not forked, to start workers with clean state also from threads
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = []
+        self.idle = queue.Queue()
+        for i in range(max(n, 1)):
+            self.idle.put(self.start_worker())
+        self.tmp_dir = tempfile.mkdtemp()
+        authkey = secrets.token_bytes(16)
+        self.listener = Listener(os.path.join(self.tmp_dir, 'workers'),
+                                 family='AF_UNIX',
+                                 authkey=authkey)
+        os.environ[WORKER_ADDRESS] = self.listener.address
+        os.environ[WORKER_AUTHKEY] = authkey.hex()
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def start_worker(self):
+        conn, child = self.context.Pipe()
+        process = self.context.Process(target=worker_main,
+                                       args=(child, ),
+                                       daemon=True)
+        process.start()
+        child.close()
+        self.processes.append(process)
+        return process, conn
+
+    def serve(self):
+        import threading
+        from multiprocessing import AuthenticationError
+        while True:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                continue
+            except OSError:
+                # listener closed
+                break
+            threading.Thread(target=self.handle, args=(conn, ),
+                             daemon=True).start()
+
+    def handle(self, conn):
+        process = pipe = None
+        try:
+            job = conn.recv()
+            process, pipe = self.idle.get()
+            try:
+                pipe.send(job)
+                error = pipe.recv()
+            except (EOFError, OSError):
+                # worker died, for example of a crash in compiled code
+                error = f"Python worker exited unexpectedly running module instance ``{job[1][0]}``."
+                pipe.close()
+                process = pipe = None
+                process, pipe = self.start_worker()
+            conn.send(error)
+        except (EOFError, OSError):
+            # client is gone, for example a killed SoS substep
+            pass
+        finally:
+            conn.close()
+            # worker is always returned to the pool
+            if pipe is not None:
+                self.idle.put((process, pipe))
+
+    def close(self):
+        import shutil
+        self.listener.close()
+        while not self.idle.empty():
+            process, pipe = self.idle.get()
+            try:
+                pipe.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.environ.pop(WORKER_ADDRESS, None)
+        os.environ.pop(WORKER_AUTHKEY, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def sos_run_worker(script, instances, workdir=None):
+    '''
+    Run `instances` of a Python module, expanded from `script` as
+    `sos_batch_script` does, in a process of the pool of DSC workers.
+    '''
+    import shutil, tempfile
+    from multiprocessing.connection import Client
+    from .utils import sos_expand_script
+    if not os.environ.get(WORKER_ADDRESS):
+        raise RuntimeError('Pool of Python workers is not running.')
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        scripts, outputs = sos_expand_script(script, instances, tmp_dir)
+        with Client(os.environ[WORKER_ADDRESS],
+                    family='AF_UNIX',
+                    authkey=bytes.fromhex(
+                        os.environ[WORKER_AUTHKEY])) as conn:
+            conn.send((scripts, outputs,
+                       os.path.abspath(workdir) if workdir else None))
+            error = conn.recv()
+    finally:
+        shutil.rmtree(tmp_dir)
+    if error:
+        raise RuntimeError(error)
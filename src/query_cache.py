@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+__author__ = "Gao Wang"
+__copyright__ = "Copyright 2016, Stephens lab"
+__email__ = "gaow@uchicago.edu"
+__license__ = "MIT"
+'''
+Cache of query results. Each entry is a folder of parquet files, one per
+output table, keyed by the content of the database and the query.
+'''
+import os, json, shutil
+from .utils import xxh, logger
+from .version import __version__
+
+QUERY_CACHE_SIZE = 1024
+
+
+def hash_file(filename, block=1 << 20):
+    res = xxh()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            res.update(chunk)
+    return res.hexdigest()
+
+
+class QueryCache:
+    def __init__(self, path, limit=QUERY_CACHE_SIZE):
+        '''
+        path: folder of cache
+        limit: size limit of cache in MB; least recently used entries are
+        removed when it is exceeded
+        '''
+        self.path = path
+        self.limit = limit * 1024 * 1024
+        # database fingerprint: path -> (size, mtime, hash)
+        self.fingerprints = dict()
+        # key -> query specification
+        self.specs = dict()
+
+    def fingerprint(self, db):
+        '''Hash of database file, re-computed only when the file changes'''
+        stat = os.stat(db)
+        fingerprints = os.path.join(self.path, 'fingerprints.json')
+        if not self.fingerprints and os.path.isfile(fingerprints):
+            try:
+                self.fingerprints = json.load(open(fingerprints))
+            except Exception:
+                self.fingerprints = dict()
+        db = os.path.abspath(db)
+        if db in self.fingerprints and self.fingerprints[db][:2] == [
+                stat.st_size, stat.st_mtime_ns
+        ]:
+            return self.fingerprints[db][2]
+        value = hash_file(db)
+        self.fingerprints[db] = [stat.st_size, stat.st_mtime_ns, value]
+        os.makedirs(self.path, exist_ok=True)
+        with open(fingerprints, 'w') as f:
+            json.dump(self.fingerprints, f)
+        return value
+
+    def get_key(self, db, targets, condition=None, groups=None, **kwargs):
+        spec = dict(db=self.fingerprint(db),
+                    targets=targets,
+                    condition=[x.strip() for x in condition or []],
+                    groups=[x.strip() for x in groups or []],
+                    version=__version__,
+                    **kwargs)
+        spec = json.dumps(spec, sort_keys=True)
+        key = xxh(spec.encode()).hexdigest()
+        self.specs[key] = spec
+        return key
+
+    def get(self, key):
+        '''Return cached result as a dict, or None if not available'''
+        from .dsc_io import load_parquet
+        entry = os.path.join(self.path, key)
+        manifest = os.path.join(entry, 'manifest.json')
+        if not os.path.isfile(manifest):
+            return None
+        try:
+            res = json.load(open(manifest))
+            spec = res.pop('spec', None)
+            if key in self.specs and spec != self.specs[key]:
+                # hash collision
+                return None
+            res['output_table'] = load_parquet(
+                os.path.join(entry, 'output_table.parquet'))[0]
+            res['output_tables'] = dict([
+                (k, load_parquet(os.path.join(entry, f'{idx}.parquet'))[0])
+                for idx, k in enumerate(res['output_tables'])
+            ])
+        except Exception as e:
+            logger.debug(f'Failed to load query cache ``{entry}``: {e}')
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        # mark as recently used
+        os.utime(manifest)
+        return res
+
+    def put(self, key, queries, output_table, output_tables, warnings=None):
+        from .dsc_io import save_parquet
+        os.makedirs(self.path, exist_ok=True)
+        entry = os.path.join(self.path, key)
+        tmp = entry + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            os.makedirs(tmp)
+            save_parquet(output_table,
+                         os.path.join(tmp, 'output_table.parquet'))
+            for idx, k in enumerate(output_tables):
+                save_parquet(output_tables[k],
+                             os.path.join(tmp, f'{idx}.parquet'))
+            # manifest is written last: an entry without it is incomplete
+            with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+                json.dump(
+                    dict(spec=self.specs.get(key),
+                         queries=queries,
+                         output_tables=list(output_tables.keys()),
+                         warnings=warnings or []), f)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        except Exception as e:
+            logger.debug(f'Failed to save query cache ``{entry}``: {e}')
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        '''Remove least recently used entries until cache fits in size limit'''
+        entries = []
+        for x in os.listdir(self.path):
+            manifest = os.path.join(self.path, x, 'manifest.json')
+            if not os.path.isfile(manifest):
+                continue
+            size = sum([
+                os.path.getsize(os.path.join(self.path, x, y))
+                for y in os.listdir(os.path.join(self.path, x))
+            ])
+            entries.append((os.path.getmtime(manifest), size, x))
+        total = sum([x[1] for x in entries])
+        for _, size, x in sorted(entries):
+            if total <= self.limit:
+                break
+            shutil.rmtree(os.path.join(self.path, x), ignore_errors=True)
+            total -= size
+
+
+class OutputCache:
+    '''
+    Scalar values of module output variables, keyed by output file and its
+    modification time so that values of a file are not read again until
+    the file changes.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+
+    def connect(self):
+        import sqlite3
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)),
+                    exist_ok=True)
+        conn = sqlite3.connect(self.filename, timeout=60)
+        conn.execute('CREATE TABLE IF NOT EXISTS outputs '
+                     '(path TEXT, mtime INTEGER, var TEXT, scalar INTEGER, '
+                     'value TEXT, PRIMARY KEY (path, var))')
+        return conn
+
+    def get(self, files):
+        '''
+        files: {path: (mtime, keys)}
+        Return {path: {key: (is scalar, value)}} of cached values
+        '''
+        res = dict()
+        conn = self.connect()
+        try:
+            for path, (mtime, keys) in files.items():
+                rows = conn.execute(
+                    'SELECT var, scalar, value FROM outputs WHERE path = ? AND mtime = ?',
+                    (path, mtime)).fetchall()
+                values = dict([(var, (bool(scalar), json.loads(value)))
+                               for var, scalar, value in rows
+                               if var in keys])
+                if len(values):
+                    res[path] = values
+        finally:
+            conn.close()
+        return res
+
+    def put(self, values):
+        '''
+        values: {path: (mtime, {key: (is scalar, value)})}
+        '''
+        conn = self.connect()
+        try:
+            with conn:
+                for path, (mtime, items) in values.items():
+                    conn.execute(
+                        'DELETE FROM outputs WHERE path = ? AND mtime != ?',
+                        (path, mtime))
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?)',
+                        [(path, mtime, k, int(v[0]), json.dumps(v[1]))
+                         for k, v in items.items()])
+        finally:
+            conn.close()
@@ -3,10 +3,13 @@ __author__ = "Gao Wang"
 __copyright__ = "Copyright 2016, Stephens lab"
 __email__ = "gaow@uchicago.edu"
 __license__ = "MIT"
-import os, re, pickle
+import os, re, sqlite3
 import pandas as pd, numpy as np
 from .utils import uniq_list, case_insensitive_uniq_list, flatten_list, filter_sublist, FormatError, DBError, logger
 from .yhat_sqldf import sqldf
+from .query_pandas import pdquery, pushdown, PandasQueryError
+from .query_cache import QueryCache
+from .dsc_database import load_db
 from .line import parse_filter
 
 # keywords for SQLite
@@ -45,15 +48,67 @@ def find_partial_index(xx, ordering):
     raise ValueError(f'{xx} not in list {ordering}')
 
 
+def coalesce(values, mask):
+    '''
+    Row-wise coalesce of a 2D array.
+    values: rows x columns array; mask: where entries are available.
+    Return value of the first available entry of each row, or NA,
+    index of the column it comes from, and number of available entries.
+    '''
+    count = mask.sum(axis=1)
+    if values.shape[1] == 0:
+        return np.full(values.shape[0], NA, dtype=object), count, count
+    source = mask.argmax(axis=1)
+    res = values[np.arange(values.shape[0]), source].astype(object)
+    res[count == 0] = NA
+    return res, source, count
+
+
 class Query_Processor:
-    def __init__(self, db, targets, condition=None, groups=None):
+    def __init__(self,
+                 db,
+                 targets,
+                 condition=None,
+                 groups=None,
+                 engine='sqlite',
+                 jobs=1,
+                 cache=None):
         self.db = db
+        self.jobs = max(int(jobs), 1)
+        if engine not in ['sqlite', 'pandas']:
+            raise DBError(f"Invalid query engine ``{engine}``")
+        self.engine = engine
         self.targets = uniq_list(' '.join(targets).split())
         self.raw_condition = condition
-        with open(os.path.expanduser(db), 'rb') as f:
-            self.data = pickle.load(f)
+        # 0. load results of the same query from cache when available;
+        # only query results are restored in this case, not the database
+        if cache is not None:
+            if isinstance(cache, str):
+                cache = QueryCache(cache)
+            cache_key = cache.get_key(os.path.expanduser(db),
+                                      self.targets,
+                                      condition,
+                                      groups,
+                                      engine=engine)
+            res = cache.get(cache_key)
+            if res is not None:
+                self.data = None
+                self.queries = res['queries']
+                self.output_tables = res['output_tables']
+                self.output_table = res['output_table']
+                self.field_warnings = dict(enumerate(res['warnings']))
+                self.warn()
+                return
+        # module tables are loaded on demand
+        self.data = load_db(os.path.expanduser(db))
+        # on-disk indexed database built along side with `.db`, if available
+        self.sqlite_db = os.path.expanduser(db)[:-3] + '.sqlite'
+        if not os.path.isfile(self.sqlite_db):
+            self.sqlite_db = None
         # table: msg map
         self.field_warnings = {}
+        # table: columns added to make module groups compatible
+        self.na_columns = dict()
         if '.groups' in self.data:
             self.groups = self.data['.groups']
         else:
@@ -84,19 +139,29 @@ class Query_Processor:
         self.pipelines, self.target_tables, self.condition_tables = self.filter_pipelines(
             self.data['.pipelines'])
         # 5. make select / from / where clause
-        select_clauses = self.get_select_clause()
+        select_clauses, select_specs = self.get_select_clause()
         from_clauses = self.get_from_clause()
-        where_clauses = self.get_where_clause()
-        self.queries = uniq_list([
-            ' '.join(x)
-            for x in list(zip(*[select_clauses, from_clauses, where_clauses]))
-        ])
+        where_specs = self.get_where_specs()
+        where_clauses = self.get_where_clause(where_specs)
+        self.queries = []
+        # structured form of each query, for the pandas engine
+        self.query_plans = []
+        for clauses, plan in zip(
+                zip(select_clauses, from_clauses, where_clauses),
+                zip(select_specs, where_specs)):
+            query = ' '.join(clauses)
+            if query not in self.queries:
+                self.queries.append(query)
+                self.query_plans.append(plan)
         # 6. run queries
         self.output_tables = self.run_queries()
         # 7. merge table
         self.output_table = self.merge_tables()
         # 8. fillna
         self.fillna()
+        if cache is not None:
+            cache.put(cache_key, self.queries, self.output_table,
+                      self.output_tables, list(self.field_warnings.values()))
         # 9. finally show warnings
         self.warn()
 
@@ -137,16 +202,20 @@ class Query_Processor:
         if y_low == 'dsc_replicate':
             raise DBError(
                 f'Cannot query on ``DSC_REPLICATE`` in module ``{k}``')
-        if y_low in [i.lower() for i in self.data[k]] and y_low in [
+        columns = [i.lower() for i in self.data.get_columns(k)]
+        if y_low in columns and y_low in [
                 i.lower() for i in self.data['.output'][k]
+        ] and y_low not in [
+                i.lower()
+                for i in self.data.get('.materialized', dict()).get(k, [])
         ] and check_field == 1:
             self.field_warnings[
                 k] = f"Variable ``{y}`` is both parameter and output in module ``{k}``. Parameter variable ``{y}`` is extracted. To obtain output variable ``{y}`` please use ``{k}.output.{y}`` to specify the query target."
-        if not y_low in [i.lower() for i in self.data[k]] and check_field == 2:
+        if not y_low in columns and check_field == 2:
             raise DBError(f"Cannot find column ``{y}`` in table ``{k}``")
         if y_low.startswith('output.'):
             y_low = y_low[7:]
-        if y_low not in [i.lower() for i in self.data[k]] and y_low not in [
+        if y_low not in columns and y_low not in [
                 i.lower() for i in self.data['.output'][k]
         ] and check_field == 1:
             raise DBError(f"Cannot find variable ``{y}`` in module ``{k}``")
@@ -212,7 +281,7 @@ class Query_Processor:
         for group in list(self.groups.keys()):
             params = uniq_list(
                 flatten_list([
-                    self.data[item].columns.tolist()
+                    self.data.get_columns(item)
                     for item in self.groups[group] if item in self.data
                 ]))
             if len(params) == 0:
@@ -227,8 +296,11 @@ class Query_Processor:
                 for module in self.groups[group]:
                     if module not in self.data:
                         continue
-                    if param not in self.data[module].columns:
-                        self.data[module][param] = np.nan
+                    if param not in self.data.get_columns(module):
+                        self.data.add_column(module, param, np.nan)
+                        if module not in self.na_columns:
+                            self.na_columns[module] = []
+                        self.na_columns[module].append(param)
 
     def get_table_fields(self, values):
         '''
@@ -355,30 +427,39 @@ class Query_Processor:
     def get_one_select_clause(self, pipeline, tables):
         clause = []
         fields = []
+        # (alias, table, column) for each selected item;
+        # column is None for a constant item
+        spec = []
         tables = [(pipeline[-1], 'DSC_REPLICATE')] + tables
         for item in tables:
             fields.append('.'.join(item) if item[1] else item[0])
             if item[1] is None:
                 clause.append("'{0}' AS {0}".format(item[0]))
+                spec.append((item[0], item[0], None))
             else:
                 idx = [
                     x for x in self.data.keys()
                     if x.lower() == item[0].lower()
                 ][0]
                 if item[1].lower() not in [
-                        x.lower() for x in self.data[idx].keys()
+                        x.lower() for x in self.data.get_columns(idx)
                 ]:
-                    clause.append('"{0}".__output__ AS {0}_DSC_VAR_{1}'.\
-                                  format(item[0], item[1] if not item[1].startswith('output.') else item[1][7:]))
+                    alias = '{0}_DSC_VAR_{1}'.format(
+                        item[0], item[1]
+                        if not item[1].startswith('output.') else item[1][7:])
+                    clause.append('"{0}".__output__ AS {1}'.format(
+                        item[0], alias))
+                    spec.append((alias, item[0], '__output__'))
                 else:
                     if item[1] == '__output__':
-                        clause.append('"{0}".{1} AS {0}_DSC_OUTPUT_'.format(
-                            item[0], item[1]))
+                        alias = '{0}_DSC_OUTPUT_'.format(item[0])
                     else:
-                        clause.append('"{0}".{1} AS {0}_DSC_FIELD_{1}'.format(
-                            item[0], item[1]))
+                        alias = '{0}_DSC_FIELD_{1}'.format(item[0], item[1])
+                    clause.append('"{0}".{1} AS {2}'.format(
+                        item[0], item[1], alias))
+                    spec.append((alias, item[0], item[1]))
         clause = "SELECT " + ', '.join(clause)
-        return clause, tables, fields
+        return clause, tables, fields, spec
 
     @staticmethod
     def match_targets(tables, fields):
@@ -410,25 +491,34 @@ class Query_Processor:
 
     def get_select_clause(self):
         select = []
+        specs = []
         for pipeline, tables in zip(self.pipelines, self.target_tables):
-            clause, tables, fields = self.get_one_select_clause(
+            clause, tables, fields, spec = self.get_one_select_clause(
                 pipeline, tables)
             if not self.match_targets(tables, fields):
                 continue
             select.append(clause)
-        return select
+            specs.append(spec)
+        return select, specs
 
-    def get_where_clause(self):
+    def get_where_clause(self, specs=None):
+        if specs is None:
+            specs = self.get_where_specs()
+        return [self.render_where_clause(x) for x in specs]
+
+    def get_where_specs(self):
         return [
-            self.get_one_where_clause(t, c, p) for t, c, p in zip(
+            self.get_one_where_spec(t, c, p) for t, c, p in zip(
                 self.target_tables, self.condition_tables, self.pipelines)
         ]
 
-    def get_one_where_clause(self, target_tables, condition_tables, pipeline):
+    def get_one_where_spec(self, target_tables, condition_tables, pipeline):
         '''
         After expanding, condition is a list of list
         the outer lists are connected by OR
         the inner lists are connected by AND
+        Each item of inner lists is itself a list of
+        (not, table, field, operator, value) connected by OR
         '''
         select_tables = case_insensitive_uniq_list(
             [x[0] for x in target_tables])
@@ -447,32 +537,30 @@ class Query_Processor:
                 else:
                     for vv in value:
                         self.check_table_field(vv[1], 2)
-                valid_idx = [
-                    idx for idx, vv in enumerate(value)
-                    if vv[1][0] in valid_tables
-                ]
-                if len(valid_idx) >= 1:
-                    value = ' OR '.join([
-                        f'{value[i][0]} ("{value[i][1][0]}".{value[i][1][1]} {value[i][2]} {value[i][3]})'
-                        if len(value[i][0]) else
-                        f'"{value[i][1][0]}".{value[i][1][1]} {value[i][2]} {value[i][3]}'
-                        for i in valid_idx
-                    ])
-                    if len(valid_idx) > 1:
-                        tmp.append(f"({value})")
-                    else:
-                        tmp.append(value)
-                else:
-                    pass
+                value = [(vv[0], vv[1][0], vv[1][1], vv[2], vv[3])
+                         for vv in value if vv[1][0] in valid_tables]
+                if len(value) >= 1:
+                    tmp.append(value)
             if len(tmp):
                 condition.append(tmp)
-        if len(condition):
-            return "WHERE " + ' OR '.join([
-                '(' + ' AND '.join([f"({y})" for y in x]) + ')'
-                for x in condition
-            ])
-        else:
+        return condition
+
+    @staticmethod
+    def render_where_clause(condition):
+        if len(condition) == 0:
             return ''
+        res = []
+        for each_and in condition:
+            tmp = []
+            for value in each_and:
+                value_str = ' OR '.join([
+                    f'{x[0]} ("{x[1]}".{x[2]} {x[3]} {x[4]})'
+                    if len(x[0]) else f'"{x[1]}".{x[2]} {x[3]} {x[4]}'
+                    for x in value
+                ])
+                tmp.append(f"({value_str})" if len(value) > 1 else value_str)
+            res.append('(' + ' AND '.join([f"({y})" for y in tmp]) + ')')
+        return "WHERE " + ' OR '.join(res)
 
     @staticmethod
     def adjust_table(table, ordering=None):
@@ -536,22 +624,20 @@ class Query_Processor:
                        reverse=True))
             for k in to_merge:
                 if len(ordered_group) > 1:
-                    table[f'{g}{k}'] = table.loc[:,
-                                                 to_merge[k]].apply(tuple, 1)
-                    non_na_idx = table[f'{g}{k}'].apply(lambda x: tuple(
-                        [idx for idx, y in enumerate(x) if y == y]))
-                    if not all([len(x) <= 1 for x in non_na_idx]):
+                    values = table.loc[:, to_merge[k]].to_numpy()
+                    # `x == x` is False for NaN only
+                    res, source, count = coalesce(values, values == values)
+                    if (count > 1).any():
                         raise DBError(
                             f'Modules ``{to_merge[k]}`` cannot be grouped into ``{g}{k}`` due to collating entries.'
                         )
-                    table[f'{g}{k}'] = table[f'{g}{k}'].apply(
-                        lambda x: [y for y in x if y == y][0]
-                        if len([y for y in x if y == y]) else NA)
+                    table[f'{g}{k}'] = pd.Series(
+                        res, index=table.index).infer_objects()
                     if g not in table:
-                        table[g] = [
-                            self.groups[g][kk[0]] if len(kk) else NA
-                            for kk in non_na_idx
-                        ]
+                        label = np.array(self.groups[g],
+                                         dtype=object)[source[count > 0]]
+                        table[g] = NA
+                        table.loc[count > 0, g] = label
                 else:
                     # it is a trivial group
                     # simply rename it
@@ -574,15 +660,13 @@ class Query_Processor:
         table = table.rename(columns={f'{g}:id': g for g in self.groups})
         # Finally deal with the `DSC_REPLICATE` column
         rep_cols = [x for x in table.columns if x.endswith('.DSC_REPLICATE')]
-        table.insert(
-            0, 'DSC',
-            table.loc[:, rep_cols].apply(lambda x: tuple(x.dropna().tolist()),
-                                         1))
-        if not all(table['DSC'].apply(len) == 1):
+        res, _, count = coalesce(table.loc[:, rep_cols].to_numpy(),
+                                 table.loc[:, rep_cols].notna().to_numpy())
+        if not (count == 1).all():
             raise DBError(
                 f'(Possible bug) DSC replicates cannot be merged due to collating entries.'
             )
-        table['DSC'] = table['DSC'].apply(lambda x: int(x[0]))
+        table.insert(0, 'DSC', res.astype(int))
         table.drop(columns=rep_cols, inplace=True)
         return table
 
@@ -613,13 +697,77 @@ class Query_Processor:
     def get_data(self):
         return self.data
 
+    def run_sqlite_query(self, query, pipeline):
+        '''
+        Execute query in place against the on-disk database:
+        tables are not loaded; columns missing from some modules in a group
+        are provided by temporary views that shadow the module tables.
+        '''
+        conn = sqlite3.connect(f'file:{self.sqlite_db}?mode=ro', uri=True)
+        try:
+            for module in pipeline:
+                if module not in self.na_columns:
+                    continue
+                na_cols = ', '.join(
+                    [f'NULL AS "{x}"' for x in self.na_columns[module]])
+                conn.execute(
+                    f'CREATE TEMP VIEW "{module}" AS SELECT *, {na_cols} FROM main."{module}"'
+                )
+            return pd.read_sql_query(query, conn)
+        finally:
+            conn.close()
+
+    def run_query(self, query, pipeline, plan=None, env=None):
+        if env is None:
+            env = self.data
+        if self.engine == 'pandas' and plan is not None:
+            try:
+                return pdquery(pipeline, plan[0], plan[1], env)
+            except PandasQueryError as e:
+                logger.warning(f'{e} Falling back to SQLite engine.')
+        if self.sqlite_db is not None:
+            return self.run_sqlite_query(query, pipeline)
+        if plan is not None:
+            # only load to SQLite the part of tables the query needs
+            try:
+                env = pushdown(pipeline,
+                               plan[0],
+                               plan[1],
+                               env,
+                               preserve_sql_types=True)
+            except PandasQueryError as e:
+                logger.debug(e)
+        return sqldf(query, env, pipeline)
+
     def run_queries(self):
         if len(self.queries) == 0:
             raise DBError("Incompatible targets ``{}``{}".\
                           format(', '.join(self.targets),
                                  f' under condition ``{" AND ".join(["(%s)" % x for x in self.raw_condition])}``' if self.raw_condition is not None else ''))
-        res = [('+'.join(reversed(pipeline)), self.adjust_table(sqldf(query.strip(), self.data, pipeline), pipeline)) \
-                     for pipeline, query in zip(self.pipelines, self.queries)]
+        def run_one(item, lock=None):
+            pipeline, query, plan = item
+            env = None
+            if lock is not None:
+                # pandas objects are not safe to read from multiple threads
+                # (internal caches are built lazily), so each query works on
+                # its own shallow copies of the tables
+                with lock:
+                    env = dict([(x, self.data[x].copy(deep=False))
+                                for x in pipeline if x in self.data])
+            return ('+'.join(reversed(pipeline)),
+                    self.adjust_table(self.run_query(query.strip(), pipeline, plan, env), pipeline))
+
+        items = list(zip(self.pipelines, self.queries, self.query_plans))
+        if self.jobs > 1 and len(items) > 1:
+            # queries on different pipelines are independent;
+            # `map` keeps results in the order of pipelines
+            import threading
+            from concurrent.futures import ThreadPoolExecutor
+            lock = threading.Lock()
+            with ThreadPoolExecutor(max_workers=min(self.jobs, len(items))) as executor:
+                res = list(executor.map(lambda x: run_one(x, lock), items))
+        else:
+            res = [run_one(item) for item in items]
         res = [x for x in res if x[1] is not None]
         if len(res) == 0:
             raise DBError("No results found for targets ``{}``{}".\
@@ -627,11 +775,198 @@ class Query_Processor:
                                  f' under condition ``{" AND ".join(["(%s)" % x for x in self.raw_condition])}``' if self.raw_condition is not None else ''))
         return dict(res)
 
+    def load_outputs(self, jobs=1, cache=None):
+        '''
+        Replace output file names in `module.var:output` columns by values
+        of the variables loaded from these files. Values that are not scalars
+        are not loaded; output file names are kept for them.
+        cache: an `OutputCache` of values previously loaded
+        '''
+        from .dsc_io import load_dsc_scalars
+        dirname = os.path.dirname(os.path.expanduser(self.db))
+        tables = [self.output_table] + list(self.output_tables.values())
+        # output file: variables to load
+        files = dict()
+        for table in tables:
+            for col in table.columns:
+                if not col.endswith(':output'):
+                    continue
+                var = col[:-len(':output')].split('.', 1)[1]
+                for x in table[col]:
+                    if isinstance(x, str) and x != 'NA':
+                        files.setdefault(x, set()).add(var)
+        # resolve file names and time stamps
+        paths = dict()
+        for x in files:
+            path = os.path.join(dirname, x)
+            path = path + '.rds' if os.path.isfile(path +
+                                                   '.rds') else path + '.pkl'
+            if os.path.isfile(path):
+                paths[x] = (path, os.stat(path).st_mtime_ns)
+            else:
+                logger.warning(f'Cannot find output file ``{path}``')
+        values = cache.get(
+            dict([(path, (mtime, files[x]))
+                  for x, (path, mtime) in paths.items()])) if cache else dict()
+        items = [(path, sorted(files[x] - set(values.get(path, dict()))))
+                 for x, (path, mtime) in paths.items()]
+        items = [x for x in items if len(x[1])]
+        if len(items):
+            logger.info(
+                f'Loading ``{len(items)}`` output files using ``{jobs}`` processes ...'
+            )
+            if jobs > 1 and len(items) > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    loaded = list(
+                        executor.map(load_dsc_scalars,
+                                     items,
+                                     chunksize=max(
+                                         len(items) // (jobs * 4), 1)))
+            else:
+                loaded = [load_dsc_scalars(x) for x in items]
+            new_values = dict()
+            for (path, keys), res in zip(items, loaded):
+                if res is None:
+                    logger.warning(f'Cannot load output file ``{path}``')
+                    continue
+                for k in keys:
+                    if k not in res:
+                        raise DBError(
+                            f'Variable ``{k}`` unavailable in ``{path}``')
+                values.setdefault(path, dict()).update(res)
+                new_values[path] = (os.stat(path).st_mtime_ns, res)
+            if cache is not None and len(new_values):
+                cache.put(new_values)
+        # fill in values
+        complex_values = set()
+
+        def get_value(x, var, col):
+            if not (isinstance(x, str) and x in paths):
+                return x
+            value = values.get(paths[x][0], dict()).get(var, (False, None))
+            if not value[0] or isinstance(value[1], (list, tuple)):
+                complex_values.add(col)
+                return x
+            return 'NA' if value[1] is None else value[1]
+
+        for table in tables:
+            for col in [x for x in table.columns if x.endswith(':output')]:
+                var = col[:-len(':output')].split('.', 1)[1]
+                table[col] = table[col].map(
+                    lambda x: get_value(x, var, col)).infer_objects()
+                if col not in complex_values:
+                    table.rename(columns={col: col[:-len(':output')]},
+                                 inplace=True)
+        for col in sorted(complex_values):
+            logger.warning(
+                f'Values of ``{col}`` are not loaded because they are not scalars.'
+            )
+
     def warn(self):
         for k in self.field_warnings:
             logger.warning(self.field_warnings[k])
 
 
+class Federated_Query_Processor:
+    '''
+    Run the same query on several DSC result databases, eg of different
+    versions of a benchmark, one database per thread. Results are put
+    together, with column `source` for the database of each row.
+    '''
+    def __init__(self,
+                 dbs,
+                 targets,
+                 condition=None,
+                 groups=None,
+                 engine='sqlite',
+                 jobs=1,
+                 cache=None,
+                 sources=None):
+        '''
+        cache: a query cache, or one for every database
+        sources: labels of databases, default to names of their folders
+        '''
+        self.dbs = list(dbs)
+        self.jobs = max(int(jobs), 1)
+        self.sources = sources or self.get_sources(self.dbs)
+        caches = cache if isinstance(cache,
+                                     (list, tuple)) else [cache] * len(self.dbs)
+
+        def run_one(item):
+            db, cache = item
+            try:
+                return Query_Processor(db, targets, condition, groups, engine,
+                                       max(self.jobs // len(self.dbs), 1),
+                                       cache)
+            except DBError as e:
+                raise DBError(f'Failed to query ``{db}``: {e}')
+
+        items = list(zip(self.dbs, caches))
+        if self.jobs > 1 and len(items) > 1:
+            # every database has its own tables, so they are queried independently
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(
+                    max_workers=min(self.jobs, len(items))) as executor:
+                self.processors = list(executor.map(run_one, items))
+        else:
+            self.processors = [run_one(item) for item in items]
+        self.queries = uniq_list(
+            flatten_list([x.get_queries() for x in self.processors]))
+        self.field_warnings = dict()
+        for x in self.processors:
+            for k, v in x.field_warnings.items():
+                self.field_warnings.setdefault(k, v)
+        self.merge_sources()
+
+    @staticmethod
+    def get_sources(dbs):
+        '''Names of folders of databases, or their paths if names are not unique'''
+        sources = [os.path.basename(x)[:-3] for x in dbs]
+        if len(set(sources)) < len(sources):
+            sources = [os.path.dirname(os.path.abspath(os.path.expanduser(x))) for x in dbs]
+        return sources
+
+    @staticmethod
+    def concat_sources(tables):
+        res = []
+        for source, table in tables:
+            table = table.copy()
+            table.insert(0, 'source', source)
+            res.append(table)
+        return pd.concat(res, ignore_index=True, sort=False).fillna('NA')
+
+    def merge_sources(self):
+        self.output_table = self.concat_sources([
+            (source, x.output_table)
+            for source, x in zip(self.sources, self.processors)
+        ])
+        tables = dict()
+        for source, x in zip(self.sources, self.processors):
+            for k, table in x.output_tables.items():
+                tables.setdefault(k, []).append((source, table))
+        self.output_tables = dict([(k, self.concat_sources(v))
+                                   for k, v in tables.items()])
+
+    def get_queries(self):
+        return self.queries
+
+    def load_outputs(self, jobs=1, cache=None):
+        '''
+        Load values of module output variables from files, see `Query_Processor.load_outputs`
+        cache: an output cache, or one for every database
+        '''
+        caches = cache if isinstance(cache,
+                                     (list, tuple)) else [cache] * len(self.dbs)
+        for x, cache in zip(self.processors, caches):
+            x.load_outputs(jobs, cache)
+        self.merge_sources()
+
+    def warn(self):
+        for x in self.processors:
+            x.warn()
+
+
 if __name__ == '__main__':
     import sys
     q = Query_Processor(sys.argv[1], [sys.argv[2]], [sys.argv[3]])
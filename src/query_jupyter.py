@@ -17,6 +17,10 @@ This page displays contents of database `{0}.db` generated by [this DSC]({0}.htm
         '' if description is None else '\n\n'.join(description))
 
 
+def get_arrow_reader(filename):
+    return 'parquet' if filename.endswith('.parquet') else 'feather'
+
+
 def write_notebook(text, output, execute=False):
     import nbformat
     nb = nbformat.reads(text, as_version=4)
@@ -33,8 +37,8 @@ def get_database_notebook(db,
                           title="Database Summary",
                           description=None,
                           limit=-1):
-    import pickle
-    data = pickle.load(open(os.path.expanduser(db), 'rb'))
+    from .dsc_database import load_db
+    data = load_db(os.path.expanduser(db))
     jc = JupyterComposer()
     jc.add("# {}\n{}".format(title, get_home_doc(db, description)))
     nn = '\n'
@@ -42,8 +46,8 @@ def get_database_notebook(db,
         f"Modules:\n\n{nn.join(['* ' + key for key in data if not key.startswith('.')])}"
     )
     jc.add('''
-import pickle
-data = pickle.load(open("{}", 'rb'))
+from dsc.dsc_database import load_db
+data = load_db("{}")
     '''.format(os.path.expanduser(db)),
            cell="code",
            out=False)
@@ -58,7 +62,7 @@ data = pickle.load(open("{}", 'rb'))
     write_notebook(jc.dump(), output)
 
 
-def get_query_notebook(db,
+def get_query_notebook(data,
                        queries,
                        output,
                        title,
@@ -66,15 +70,30 @@ def get_query_notebook(db,
                        language=None,
                        addon=None,
                        limit=-1):
+    '''
+    data: a spreadsheet, or a list of parquet / Arrow IPC files with the
+    merged table first followed by tables of each pipeline
+    '''
+    if isinstance(data, str):
+        data = [data]
+    data = [os.path.expanduser(x) for x in data]
     jc = JupyterComposer()
-    jc.add("# {}\n{}".format(title, get_home_doc(db, description)))
-    jc.add('''
+    jc.add("# {}\n{}".format(title, get_home_doc(data[0], description)))
+    if data[0].endswith('.xlsx'):
+        jc.add('''
 import pandas as pd
 xls = pd.ExcelFile('{}')
 info = [xls.parse(x) for x in xls.sheet_names]
-    '''.format(os.path.expanduser(db)),
-           cell="code",
-           out=False)
+    '''.format(data[0]),
+               cell="code",
+               out=False)
+    else:
+        jc.add('''
+import pandas as pd
+info = [pd.read_{}(x) for x in {}]
+    '''.format(get_arrow_reader(data[0]), repr(data)),
+               cell="code",
+               out=False)
     if len(queries) > 1:
         jc.add("## Merged")
         jc.add(f"%preview -n info[0] --limit {limit}", cell="code")
@@ -86,9 +105,16 @@ info = [xls.parse(x) for x in xls.sheet_names]
             cell="code")
     if language is not None:
         if language == 'R':
-            jc.add("%use R\ninfo <- readxl::read_excel('{}')".format(db),
-                   cell="code",
-                   out=False)
+            if data[0].endswith('.xlsx'):
+                jc.add("%use R\ninfo <- readxl::read_excel('{}')".format(
+                    data[0]),
+                       cell="code",
+                       out=False)
+            else:
+                jc.add("%use R\ninfo <- arrow::read_{}('{}')".format(
+                    get_arrow_reader(data[0]), data[0]),
+                       cell="code",
+                       out=False)
         else:
             jc.add("%use {}\n%get info".format(language),
                    cell="code",
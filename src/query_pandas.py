@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+__author__ = "Gao Wang"
+__copyright__ = "Copyright 2016, Stephens lab"
+__email__ = "gaow@uchicago.edu"
+__license__ = "MIT"
+'''
+Execute queries generated by `Query_Processor` natively on pandas data frames,
+as an alternative to loading tables to SQLite. The join is always a chain of
+`INNER JOIN ... ON a.__parent__ = b.__id__` which is carried out by hash joins,
+and conditions are compiled to vectorized boolean masks that follow SQL
+semantics (comparison involving NULL is never true).
+'''
+import ast
+import numpy as np, pandas as pd
+import numexpr as ne
+
+__all__ = ['pdquery', 'pushdown', 'PandasQueryError']
+
+
+class PandasQueryError(Exception):
+    """Raised when a query cannot be executed by the pandas engine."""
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+        self.args = (msg, )
+
+
+def parse_value(value, op):
+    '''Convert value in condition statement to Python literal'''
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        raise PandasQueryError(
+            f"Cannot interpret ``{value}`` as a value in pandas query.")
+    if op == 'in':
+        return list(value) if isinstance(value, (list, tuple)) else [value]
+    if isinstance(value, (list, tuple, dict, set)):
+        raise PandasQueryError(
+            f"Cannot compare to ``{value}`` with operator ``{op}``.")
+    return value
+
+
+def is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(
+        value, (bool, np.bool_))
+
+
+def as_text(value):
+    # text representation of a value as stored in a SQLite TEXT column
+    if isinstance(value, (bool, np.bool_)):
+        return str(int(value))
+    return str(value)
+
+
+def compare(values, op, value):
+    '''
+    Evaluate `values op value`.
+    Return a pair of boolean arrays, for where the comparison is TRUE
+    and where it is FALSE; where neither the result is NULL.
+    '''
+    values = pd.Series(values)
+    if pd.api.types.is_categorical_dtype(values):
+        # compare distinct values only
+        true_mask, false_mask = compare(values.cat.categories, op, value)
+        codes = values.cat.codes.to_numpy()
+        valid = codes >= 0
+        return true_mask[codes] & valid, false_mask[codes] & valid
+    valid = values.notna().to_numpy()
+    if values.dtype.kind in 'iufb':
+        x = values.to_numpy()
+        if x.dtype.kind == 'b':
+            x = x.astype(int)
+        if op == 'in':
+            res = np.isin(
+                x, [float(v) for v in value if is_number(v) or isinstance(v, bool)])
+        else:
+            if isinstance(value, str):
+                try:
+                    value = float(value)
+                except ValueError:
+                    # in SQLite numbers are smaller than text
+                    res = np.full(len(x), op in ['<', '<=', '!='])
+                    return res & valid, ~res & valid
+            res = ne.evaluate(f'x {op} v',
+                              local_dict={
+                                  'x': x,
+                                  'v': float(value)
+                              })
+    else:
+        # object column is compared as text
+        x = values[valid].map(as_text)
+        if op == 'in':
+            res_valid = x.isin([as_text(v) for v in value])
+        else:
+            value = as_text(value)
+            if op == '==':
+                res_valid = x == value
+            elif op == '!=':
+                res_valid = x != value
+            elif op == '>':
+                res_valid = x > value
+            elif op == '<':
+                res_valid = x < value
+            elif op == '>=':
+                res_valid = x >= value
+            elif op == '<=':
+                res_valid = x <= value
+            else:
+                raise PandasQueryError(f"Unsupported operator ``{op}``.")
+        res = np.zeros(len(values), dtype=bool)
+        res[valid] = res_valid.to_numpy(dtype=bool)
+    return res & valid, ~res & valid
+
+
+def get_column(table, name, column):
+    '''Column names are case insensitive, as in SQL'''
+    if column in table.columns:
+        return column
+    for x in table.columns:
+        if x.lower() == column.lower():
+            return x
+    raise PandasQueryError(f"Cannot find column ``{column}`` in ``{name}``.")
+
+
+def get_table(env, name):
+    if name in env:
+        return env[name]
+    for x in env:
+        if x.lower() == name.lower():
+            return env[x]
+    raise PandasQueryError(f"Cannot find table ``{name}``.")
+
+
+def evaluate(where, table_columns, frame):
+    '''
+    where: OR of ANDs of ORs of (not, table, field, operator, value)
+    '''
+    mask = np.zeros(len(frame), dtype=bool)
+    for each_and in where:
+        and_mask = np.ones(len(frame), dtype=bool)
+        for each_or in each_and:
+            or_mask = np.zeros(len(frame), dtype=bool)
+            for is_not, table, field, op, value in each_or:
+                true_mask, false_mask = compare(
+                    frame[table_columns[(table.lower(), field.lower())]], op,
+                    parse_value(value, op))
+                or_mask |= false_mask if is_not else true_mask
+            and_mask &= or_mask
+        mask |= and_mask
+    return mask
+
+
+def get_table_condition(where, table):
+    '''
+    Condition on `table` alone that is implied by `where`, or None if there
+    is no such condition. For `where` of form `(A1 AND B1) OR (A2 AND B2)` where
+    only `A1` and `A2` involve the table, it is `A1 OR A2`.
+    '''
+    res = []
+    for each_and in where:
+        each_and = [
+            each_or for each_or in each_and
+            if all([x[1].lower() == table.lower() for x in each_or])
+        ]
+        if len(each_and) == 0:
+            return None
+        res.append(each_and)
+    return res if len(res) else None
+
+
+def pushdown(pipeline, select, where, env, preserve_sql_types=False):
+    '''
+    Reduce tables of a query to columns that are selected, joined on or
+    filtered on, and to rows that satisfy conditions involving one table only.
+
+    preserve_sql_types: when tables are to be loaded to SQLite, do not filter
+    rows of tables with object columns mixing types, because column types
+    in SQLite are determined from data of these columns.
+
+    Returns
+    -------
+    result: dict
+        table name to reduced data frame
+    '''
+    columns = dict([(x.lower(), ['__id__', '__parent__']) for x in pipeline])
+    for _, table, column in select:
+        if column is not None:
+            columns[table.lower()].append(column)
+    for each_and in where:
+        for each_or in each_and:
+            for item in each_or:
+                columns[item[1].lower()].append(item[2])
+    res = dict()
+    for name in pipeline:
+        table = get_table(env, name)
+        cols = []
+        table_columns = dict()
+        for column in columns[name.lower()]:
+            col = get_column(table, name, column)
+            table_columns[(name.lower(), column.lower())] = col
+            if col not in cols:
+                cols.append(col)
+        table = table.loc[:, cols]
+        condition = get_table_condition(where, name)
+        if condition is not None and preserve_sql_types and any([
+                pd.api.types.infer_dtype(table[x]) not in ['string', 'empty']
+                for x in cols if table[x].dtype == object
+        ]):
+            condition = None
+        if condition is not None:
+            table = table.loc[evaluate(condition, table_columns, table)]
+        res[name] = table
+    return res
+
+
+def pdquery(pipeline, select, where, env):
+    '''
+    Query pandas data frames.
+
+    Parameters
+    ----------
+    pipeline: list
+        tables to join, in the order of `FROM pipeline[0] INNER JOIN pipeline[1] ...`
+    select: list
+        (alias, table, column) to select
+    where: list
+        structured conditions, see `evaluate`
+    env: dict
+        maps table names to data frames
+
+    Returns
+    -------
+    result: DataFrame
+    '''
+    env = pushdown(pipeline, select, where, env)
+    # chained hash join on a.__parent__ = b.__id__
+    frame = None
+    table_columns = dict()
+    for idx, name in enumerate(pipeline):
+        table = env[name]
+        for _, tbl, column in select:
+            if column is not None and tbl.lower() == name.lower():
+                table_columns[(name.lower(), column.lower())] = \
+                    f'{name}.{get_column(table, name, column)}'
+        for each_and in where:
+            for each_or in each_and:
+                for item in each_or:
+                    if item[1].lower() == name.lower():
+                        table_columns[(name.lower(), item[2].lower())] = \
+                            f'{name}.{get_column(table, name, item[2])}'
+        table.columns = [f'{name}.{x}' for x in table.columns]
+        if frame is None:
+            frame = table
+            continue
+        left = f'{pipeline[idx - 1]}.__parent__'
+        right = f'{name}.__id__'
+        # NULL never matches in SQL
+        frame = frame.loc[frame[left].notna()]
+        table = table.loc[table[right].notna()]
+        frame = frame.merge(table,
+                            how='inner',
+                            left_on=left,
+                            right_on=right,
+                            sort=False)
+    if len(where):
+        frame = frame.loc[evaluate(where, table_columns, frame)]
+    res = pd.DataFrame(index=frame.index)
+    for alias, table, column in select:
+        if column is None:
+            res[alias] = table
+        else:
+            res[alias] = frame[table_columns[(table.lower(), column.lower())]]
+            if pd.api.types.is_categorical_dtype(res[alias]):
+                # NULL values of text columns are returned as None by SQLite
+                res[alias] = res[alias].astype(object).where(
+                    res[alias].notna(), None)
+            if res[alias].isna().all():
+                # SQLite returns NULL column as None
+                res[alias] = pd.Series([None] * len(res),
+                                       index=res.index,
+                                       dtype=object)
+    return res.reset_index(drop=True)
@@ -440,12 +440,18 @@ def extend_dict(dict1, dict2, unique=False):
     return dict1
 
 
-def sos_hash_output(values, jobs=1):
+def sos_hash_output(values):
     '''
-    Parallel hash
-    FIXME: parallel not implemented for now
+    Hash of every value in `values`, same as `xxh(value).hexdigest()`.
+    Values are hashed in one call rather than one by one; this is not done
+    in parallel because passing values and hashes between processes takes
+    longer than hashing them.
     '''
-    return [xxh(value).hexdigest() for value in values]
+    try:
+        from xxhash import xxh32_hexdigest
+    except ImportError:
+        return [xxh(value).hexdigest() for value in values]
+    return list(map(xxh32_hexdigest, values))
 
 
 def chunks(l, n):
@@ -532,6 +538,87 @@ def sos_group_input(*lsts):
         chain(*islice(zip(*(cycle(l) for l in lsts)), 0, len(lsts[-1]))))
 
 
+BATCH_PY = '''
+import os, sys, runpy, contextlib, traceback
+for DSC_SCRIPT_, DSC_OUTPUT_ in zip({scripts}, {outputs}):
+    with open(DSC_OUTPUT_ + '.stdout', 'w') as DSC_STDOUT_, open(DSC_OUTPUT_ + '.stderr', 'w') as DSC_STDERR_, \\
+         contextlib.redirect_stdout(DSC_STDOUT_), contextlib.redirect_stderr(DSC_STDERR_):
+        try:
+            runpy.run_path(DSC_SCRIPT_, run_name = '__main__')
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                raise
+        except BaseException:
+            traceback.print_exc()
+            raise
+    os.remove(DSC_SCRIPT_)
+os.rmdir({tmp_dir})
+'''
+
+BATCH_R = '''
+DSC_SCRIPTS_ <- c({scripts})
+DSC_OUTPUTS_ <- c({outputs})
+for (DSC_I_ in seq_along(DSC_SCRIPTS_)) {{
+  DSC_STDOUT_ <- file(paste0(DSC_OUTPUTS_[DSC_I_], ".stdout"), open = "wt")
+  DSC_STDERR_ <- file(paste0(DSC_OUTPUTS_[DSC_I_], ".stderr"), open = "wt")
+  sink(DSC_STDOUT_)
+  sink(DSC_STDERR_, type = "message")
+  tryCatch(withCallingHandlers(source(DSC_SCRIPTS_[DSC_I_], local = new.env()),
+                               error = function(e) message(conditionMessage(e))),
+           finally = {{sink(type = "message"); sink(); close(DSC_STDOUT_); close(DSC_STDERR_)}})
+  file.remove(DSC_SCRIPTS_[DSC_I_])
+}}
+unlink({tmp_dir}, recursive = TRUE)
+'''
+
+
+def sos_expand_script(script, instances, tmp_dir, ext='.py', sigil='${ }'):
+    '''
+    Write `script` of a module expanded for each of `instances`, which are
+    dicts of variables of SoS substeps with `_output` and `_input` as lists
+    of files, to `tmp_dir`. Return the scripts and the output files of the
+    instances without extension.
+    '''
+    from sos.eval import interpolate
+    from sos.parser import replace_sigil
+    from sos.targets import paths, sos_targets
+    script = replace_sigil(script, sigil)
+    scripts = []
+    outputs = []
+    for idx, instance in enumerate(instances):
+        instance = dict(instance)
+        instance['_output'] = sos_targets(instance['_output'])
+        instance['_input'] = sos_targets(instance.get('_input', []))
+        scripts.append(os.path.join(tmp_dir, f'{idx + 1}{ext}'))
+        outputs.append(
+            os.path.abspath(os.path.splitext(str(instance['_output'][0]))[0]))
+        with open(scripts[-1], 'w') as f:
+            # as globals, which comprehensions in script can see
+            f.write(interpolate(script, dict(instance, paths=paths)))
+    return scripts, outputs
+
+
+def sos_batch_script(script, interpreter, instances, sigil='${ }'):
+    '''
+    Expand `script` of a module for each of `instances` as
+    `sos_expand_script` does, and return script running them all in one
+    `interpreter` ("python" or "R") process. Output to stdout and stderr is
+    written to the same files per instance as if instances were run one by one.
+    '''
+    import json, tempfile
+    tmp_dir = tempfile.mkdtemp()
+    scripts, outputs = sos_expand_script(
+        script, instances, tmp_dir,
+        '.py' if interpreter == 'python' else '.R', sigil)
+    if interpreter == 'python':
+        return BATCH_PY.format(scripts=repr(scripts),
+                               outputs=repr(outputs),
+                               tmp_dir=repr(tmp_dir))
+    return BATCH_R.format(scripts=', '.join(map(json.dumps, scripts)),
+                          outputs=', '.join(map(json.dumps, outputs)),
+                          tmp_dir=json.dumps(tmp_dir))
+
+
 def round_print(text, sep, pc=None):
     if pc is None:
         print(text)
@@ -846,13 +933,160 @@ def n2a(col_num, col_abs=False):
     return col_abs + col_str
 
 
+MPK_RECORDS = 'DSC_MPK_RECORDS'
+
+
+def dump_mpk_records(filename, items):
+    '''
+    Write (key, value) items to msgpack file as a stream of framed records:
+    a header, one [key, value] record per item, and a footer [None, index]
+    where index is [key, offset] of every record, followed by 8 bytes of
+    offset of the footer. Items can be a generator, so that they do not
+    have to be kept in memory.
+    '''
+    with MpkRecordsWriter(filename) as writer:
+        for key, value in items:
+            writer[key] = value
+
+
+class MpkRecordsWriter:
+    '''
+    Write records to file in format of `dump_mpk_records` one at a time,
+    each as soon as it is set. The file is in place when writer is closed,
+    and is discarded if an error occurs in a `with` block.
+    '''
+    def __init__(self, filename):
+        import msgpack
+        self.filename = filename
+        self.packer = msgpack.Packer(use_bin_type=False)
+        self.index = []
+        self.keys = set()
+        self.file = open(filename + '.tmp', 'wb')
+        self.file.write(self.packer.pack(MPK_RECORDS))
+
+    def __setitem__(self, key, value):
+        if key in self.keys:
+            raise ValueError(
+                f'Record ``{key}`` is already written to ``{self.filename}``.')
+        self.keys.add(key)
+        self.index.append([key, self.file.tell()])
+        self.file.write(self.packer.pack([key, value]))
+
+    def close(self):
+        import struct
+        offset = self.file.tell()
+        self.file.write(self.packer.pack([None, self.index]))
+        self.file.write(struct.pack('>Q', offset))
+        self.file.close()
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.filename + '.tmp')
+
+
+class MpkRecords(collections.abc.Mapping):
+    '''
+    Read-only mapping of records in file written by `dump_mpk_records`,
+    where a value is loaded from disk when its key is accessed. A file of
+    one msgpack map, as written by previous versions of DSC, is loaded as a
+    whole.
+    '''
+    def __init__(self, filename):
+        import struct
+        self.filename = filename
+        self.data = None
+        with open(filename, 'rb') as f:
+            header = next(self.unpacker(f))
+            if header != MPK_RECORDS:
+                self.data = header
+                self.index = collections.OrderedDict([(x, None)
+                                                      for x in header])
+                return
+            f.seek(-8, os.SEEK_END)
+            f.seek(struct.unpack('>Q', f.read(8))[0])
+            self.index = collections.OrderedDict(next(self.unpacker(f))[1])
+
+    @staticmethod
+    def unpacker(f):
+        import msgpack
+        return msgpack.Unpacker(f,
+                                encoding='utf-8',
+                                object_pairs_hook=collections.OrderedDict,
+                                max_buffer_size=2**31 - 1)
+
+    def __getitem__(self, key):
+        if self.data is not None:
+            return self.data[key]
+        offset = self.index[key]
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            return next(self.unpacker(f))[1]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def stream(self):
+        '''Generator of (key, value) of records, in one pass of the file'''
+        if self.data is not None:
+            yield from self.data.items()
+            return
+        with open(self.filename, 'rb') as f:
+            unpacker = self.unpacker(f)
+            next(unpacker)
+            for key, value in unpacker:
+                if key is None:
+                    break
+                yield key, value
+
+
+def load_mpk_records(filename):
+    '''Load all records of file written by `dump_mpk_records`'''
+    return collections.OrderedDict(MpkRecords(filename).stream())
+
+
 def load_io_db(fn, sequence_id=None, module=None):
-    import msgpack
+    # self-contained: its source code is included in DSC job scripts
+    # see `dump_mpk_records` for format of file
+    import msgpack, struct
     from collections import OrderedDict
-    data = msgpack.unpackb(open(fn, 'rb').read(),
-                           encoding='utf-8',
-                           object_pairs_hook=OrderedDict)
-    return data[sequence_id][module] if sequence_id and module else data
+    with open(fn, 'rb') as f:
+        unpacker = msgpack.Unpacker(f,
+                                    encoding='utf-8',
+                                    object_pairs_hook=OrderedDict,
+                                    max_buffer_size=2**31 - 1)
+        data = next(unpacker)
+        if data != 'DSC_MPK_RECORDS':
+            return data[sequence_id][module] if sequence_id and module else data
+        if sequence_id and module:
+            f.seek(-8, 2)
+            f.seek(struct.unpack('>Q', f.read(8))[0])
+            index = dict(
+                next(msgpack.Unpacker(f, encoding='utf-8'))[1])
+            f.seek(index[sequence_id])
+            return next(
+                msgpack.Unpacker(f,
+                                 encoding='utf-8',
+                                 object_pairs_hook=OrderedDict,
+                                 max_buffer_size=2**31 - 1))[1][module]
+        data = OrderedDict()
+        for key, value in unpacker:
+            if key is None:
+                break
+            data[key] = value
+        return data
 
 
 def is_sublist(sub, lst):
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+'''
+Benchmarks for performance critical steps of DSC.
+Not part of the test suite; run for example with
+
+    python benchmark.py merge_tables
+'''
+import sys, time
+import numpy as np, pandas as pd
+
+
+def timeit(func, *args, repeat=3):
+    res = []
+    for i in range(repeat):
+        tic = time.perf_counter()
+        func(*args)
+        res.append(time.perf_counter() - tic)
+    return min(res)
+
+
+def make_output_tables(nrow, nmodule=4):
+    '''Output tables of a group `analyze` of `nmodule` methods, nrow rows in total'''
+    tables = dict()
+    size = nrow // nmodule
+    for i in range(nmodule):
+        m = f'method{i}'
+        tables[f'score+{m}+simulate'] = pd.DataFrame({
+            'simulate.DSC_REPLICATE':
+            np.arange(size) % 50 + 1,
+            'simulate.n':
+            np.random.randint(100, 1000, size),
+            f'{m}.output.file': [f'{m}/simulate_{j}_{m}_1' for j in range(size)],
+            f'{m}.alpha':
+            np.random.rand(size),
+            'score.output.file':
+            [f'score/simulate_{j}_{m}_1_score_1' for j in range(size)]
+        })
+    return tables, dict([('analyze', [f'method{i}' for i in range(nmodule)])])
+
+
+def bench_merge_tables(sizes=(10000, 100000, 1000000)):
+    from dsc.query_engine import Query_Processor
+    print('rows\tseconds')
+    for nrow in sizes:
+        tables, groups = make_output_tables(nrow)
+
+        def run():
+            qp = Query_Processor.__new__(Query_Processor)
+            qp.output_tables = tables
+            qp.groups = dict([(k, list(v)) for k, v in groups.items()])
+            qp.targets = ['simulate.n', 'analyze', 'analyze.alpha', 'score']
+            return qp.merge_tables()
+
+        print(f'{nrow}\t{timeit(run):.3f}')
+
+
+def make_io_db(filename, ninstance, nmethod=10):
+    '''I/O records of a `simulate -> mean` pipeline of about ninstance module instances'''
+    from collections import OrderedDict
+    from dsc.utils import dump_mpk_records
+    nsim = max(ninstance // nmethod, 1)
+    sims = [f'{i:016x}' for i in range(nsim)]
+    methods = [f'{i + nsim:016x}' for i in range(nmethod)]
+    io = [('simulate:1',
+           OrderedDict([(f'simulate:{x}', {}) for x in sims] +
+                       [('__input_output___', ([], [])), ('__ext__', 'pkl')])),
+          ('mean:1',
+           OrderedDict([(f'mean:{y}:simulate:{x} simulate:{x}', {})
+                        for x in sims for y in methods] +
+                       [('__input_output___', ([], [])), ('__ext__', 'pkl')]))]
+    dump_mpk_records(filename, io)
+    dump_mpk_records(
+        filename[:-4] + '.meta.mpk',
+        [(1,
+          OrderedDict([('simulate', ['simulate', 1]),
+                       ('mean', ['mean', 1])]))])
+
+
+def bench_build_config_db(sizes=(10000, 100000, 1000000)):
+    '''Assign output file names to new instances, and again when all instances exist'''
+    import os, shutil, tempfile
+    from dsc.dsc_database import build_config_db
+    print('instances\tnew (seconds)\texisting (seconds)')
+    for ninstance in sizes:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            io_db = os.path.join(tmp_dir, 'res.io.mpk')
+            map_db = os.path.join(tmp_dir, 'res.map.sqlite')
+            conf_db = os.path.join(tmp_dir, 'res.conf.mpk')
+            make_io_db(io_db, ninstance)
+            new = timeit(build_config_db, io_db, map_db, conf_db, True, repeat=1)
+            existing = timeit(build_config_db, io_db, map_db, conf_db, repeat=1)
+        finally:
+            shutil.rmtree(tmp_dir)
+        print(f'{ninstance}\t{new:.3f}\t{existing:.3f}')
+
+
+def bench_remove_obsolete_output(sizes=(10000, 100000)):
+    '''Find obsolete files among output of nfile module instances, a tenth of them obsolete'''
+    import os, shutil, tempfile
+    from dsc.dsc_database import NameMap, remove_obsolete_output
+    print('files\tseconds')
+    for nfile in sizes:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            output = os.path.join(tmp_dir, 'res')
+            for i in range(10):
+                os.makedirs(os.path.join(output, f'method{i}'))
+            names = NameMap(os.path.join(output, 'res.map.sqlite'))
+            names.update([(f'method{i % 10}:{i}', f'method{i % 10}/simulate_{i}.pkl')
+                          for i in range(nfile) if i % 10])
+            names.close()
+            for i in range(nfile):
+                open(os.path.join(output, f'method{i % 10}', f'simulate_{i}.pkl'), 'w').close()
+            seconds = timeit(remove_obsolete_output, output, None, False, True)
+        finally:
+            shutil.rmtree(tmp_dir)
+        print(f'{nfile}\t{seconds:.3f}')
+
+
+def bench_build_db(sizes=(10000, 100000), nmodule=8, jobs=4):
+    '''Build database of nmodule methods applied to simulated data, ninstance instances per method'''
+    import os, shutil, tempfile
+    from collections import OrderedDict
+    from dsc.dsc_database import ResultDB, build_config_db
+    from dsc.utils import dump_mpk_records
+    print(f'instances\t1 process (seconds)\t{jobs} processes (seconds)')
+    cwd = os.getcwd()
+    for ninstance in sizes:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            os.chdir(tmp_dir)
+            os.makedirs('.sos')
+            os.makedirs('res')
+            sims = [f'{i:016x}' for i in range(ninstance)]
+            io = [('simulate:0',
+                   OrderedDict([(f'simulate:{x}', dict(__out_vars__=['x'], n=i % 100))
+                                for i, x in enumerate(sims)] +
+                               [('__input_output___', ([], [])), ('__ext__', 'pkl')]))]
+            meta = []
+            for m in range(1, nmodule + 1):
+                io.append((f'method{m}:{m}',
+                           OrderedDict([(f'method{m}:{m:016x}{x}:simulate:{x} simulate:{x}',
+                                         dict(__out_vars__=['y'], alpha=i / ninstance, method='lm'))
+                                        for i, x in enumerate(sims)] +
+                                       [('__input_output___', ([], [])), ('__ext__', 'pkl')])))
+                meta.append((m, OrderedDict([('simulate', ['simulate', 0]),
+                                             (f'method{m}', [f'method{m}', m])])))
+            dump_mpk_records('.sos/res.io.mpk', io)
+            dump_mpk_records('.sos/res.io.meta.mpk', meta)
+            build_config_db('.sos/res.io.mpk', 'res/res.map.sqlite', 'res/res.conf.mpk')
+            res = []
+            for n in [1, jobs]:
+                def run():
+                    # build from scratch
+                    if os.path.isfile('res/res.db'):
+                        os.remove('res/res.db')
+                    ResultDB('res/res').Build(jobs=n)
+                res.append(timeit(run, repeat=1))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmp_dir)
+        print(f'{ninstance}\t{res[0]:.3f}\t{res[1]:.3f}')
+
+
+def bench_hash_output(sizes=(10**4, 10**5, 10**6, 10**7)):
+    '''Hash module instances of a grid of parameter combinations, as `prepare_io` does'''
+    from dsc.utils import sos_hash_output, xxh
+    print('combinations\tone by one (seconds)\tin one call (seconds)')
+    for size in sizes:
+        values = ['mean mean.R x:{} y:{}'.format(_x, _y) for _x in range(size // 100) for _y in range(100)]
+        print(f'{size}\t{timeit(lambda: [xxh(x).hexdigest() for x in values], repeat=1):.3f}'
+              f'\t{timeit(sos_hash_output, values, repeat=1):.3f}')
+
+if __name__ == '__main__':
+    benchmarks = dict([(k[6:], v) for k, v in globals().items()
+                       if k.startswith('bench_')])
+    for name in (sys.argv[1:] or benchmarks.keys()):
+        print(f'# {name}')
+        benchmarks[name]()
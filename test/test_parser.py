@@ -3,10 +3,14 @@
 # Copyright (c) Gao Wang, Stephens Lab at The Univeristy of Chicago
 # Distributed under the terms of the MIT License.
 
+import os
+import shutil
 import subprocess
+import tempfile
 import unittest
 
 from dsc.dsc_parser import DSC_Script
+from dsc.dsc_translator import TranslationCache
 from dsc.utils import FormatError
 
 text0 = '''
@@ -556,6 +560,48 @@ simulate: Python()
         self.assertEqual(res.modules['simulate'].dump()['input']['K'], ["'TRUE'", "'FALSE'", "'NULL'"])
 
 
+class TestTranslationCache(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        os.makedirs('.sos')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def testTranslationCache(self):
+        '''translation is reused until DSC script, module scripts or options change'''
+        with open('t.dsc', 'w') as f:
+            f.write('simulate: sim.py\n    n: 10, 20\n    $x: x\nDSC:\n    run: simulate\n')
+        with open('sim.py', 'w') as f:
+            f.write('x = n\n')
+        cache = TranslationCache('t.dsc', [None, 2])
+        self.assertIsNone(cache.load())
+        cache.save(DSC_Script('t.dsc'), ('pipeline', []))
+        self.assertEqual(TranslationCache('t.dsc', [None, 2]).load(), ('pipeline', []))
+        self.assertIsNone(TranslationCache('t.dsc', [None, 3]).load())
+        with open('sim.py', 'w') as f:
+            f.write('x = n + 1\n')
+        self.assertIsNone(TranslationCache('t.dsc', [None, 2]).load())
+        cache.save(DSC_Script('t.dsc'), ('pipeline', []))
+        with open('t.dsc', 'a') as f:
+            f.write('    replicate: 2\n')
+        self.assertIsNone(TranslationCache('t.dsc', [None, 2]).load())
+        # module script in "exec_path" shadowed by one in working directory
+        os.makedirs('bin')
+        os.rename('sim.py', 'bin/sim.py')
+        with open('t.dsc', 'a') as f:
+            f.write('    exec_path: bin\n')
+        cache = TranslationCache('t.dsc', [None, 2])
+        cache.save(DSC_Script('t.dsc'), ('pipeline', []))
+        self.assertEqual(TranslationCache('t.dsc', [None, 2]).load(), ('pipeline', []))
+        with open('sim.py', 'w') as f:
+            f.write('x = n + 1\n')
+        self.assertIsNone(TranslationCache('t.dsc', [None, 2]).load())
+
+
 if __name__ == '__main__':
     #suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestParser)
     # unittest.TextTestRunner(, suite).run()
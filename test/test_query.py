@@ -3,11 +3,23 @@
 # Copyright (c) Gao Wang, Stephens Lab at The Univeristy of Chicago
 # Distributed under the terms of the MIT License.
 
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
+from collections import OrderedDict
 
-from dsc.query_engine import Query_Processor
+import msgpack
+from dsc.query_engine import Query_Processor, Federated_Query_Processor
 import pandas as pd
-from dsc.utils import DBError
+import numpy as np
+from dsc.dsc_database import ResultDB, NameMap, save_db, load_db, build_config_db, write_sqlite_db, \
+    remove_obsolete_output, set_column_types, merge_output
+from dsc.dsc_io import save_arrow
+from dsc.query_cache import QueryCache, OutputCache
+from dsc.query_pandas import pdquery, pushdown
+from dsc.utils import DBError, flatten_list, dump_mpk_records
 from sos.targets import file_target
 from sos.utils import get_output
 
@@ -26,6 +38,27 @@ def test_outcome(res, fn):
         res.output_table.to_csv(fn, index = False)
     return res.get_queries()
 
+def sort_table(table):
+    return table.astype(str).sort_values(list(table.columns)).reset_index(drop = True)
+
+def instance(module, idx, parent = None, **kwargs):
+    '''I/O record of a module instance'''
+    key = f'{module}:{idx}' + (f':{parent} {parent}' if parent else '')
+    return key, dict([('__pipeline_id__', 1), ('__pipeline_name__', 'a'), ('__module__', module),
+                      ('__out_vars__', ['x'])] + list(kwargs.items()))
+
+def pipeline_module(*instances):
+    return OrderedDict(list(instances) + [('__input_output___', ([], [])), ('__ext__', 'pkl')])
+
+def build_db(name, io, meta, jobs = 1):
+    '''build database of benchmark `name` from its I/O records, in current folder'''
+    os.makedirs(name, exist_ok = True)
+    dump_mpk_records(f'.sos/{name}.io.mpk', io.items())
+    dump_mpk_records(f'.sos/{name}.io.meta.mpk', meta.items())
+    build_config_db(f'.sos/{name}.io.mpk', f'{name}/{name}.map.sqlite', f'{name}/{name}.conf.mpk')
+    ResultDB(f'{name}/{name}').Build(groups = {}, pipelines = [list(x.keys()) for x in meta.values()], jobs = jobs)
+    return load_db(f'{name}/{name}.db')
+
 ash_db = 'data/dsc_result.db'
 reg_db = 'data/reg_result.db'
 cause_db = 'data/cause_result.db'
@@ -33,11 +66,15 @@ cause_db = 'data/cause_result.db'
 class TestQuery(unittest.TestCase):
     def setUp(self):
         self.temp_files = []
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
 
     def tearDown(self):
         for f in self.temp_files:
             if file_target(f).exists():
                 file_target(f).unlink()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp_dir)
 
     def touch(self, files):
         '''create temporary files'''
@@ -116,6 +153,368 @@ DSC,simulate.q,cis,cis.output.file,cis.ci_upr:output,cis.ci_lwr:output,summ_prob
 '''.strip().split('\n')
         self.assertEqual(observed, expected)
 
+    def testSQLiteDatabase(self):
+        '''query an on-disk SQLite database in place'''
+        db = os.path.join(self.tmp_dir, 'reg_result.db')
+        shutil.copy(reg_db, db)
+        write_sqlite_db(pickle.load(open(db, 'rb')), db[:-3] + '.sqlite')
+        for targets, condition in [('simulate.scenario analyze score score.error'.split(), []),
+                                   ('simulate.n analyze.alpha score'.split(), ['analyze.alpha > 0'])]:
+            res1 = Query_Processor(reg_db, targets, condition)
+            res2 = Query_Processor(db, targets, condition)
+            self.assertIsNone(res1.sqlite_db)
+            self.assertEqual(res2.sqlite_db, db[:-3] + '.sqlite')
+            self.assertEqual(res1.get_queries(), res2.get_queries())
+            pd.testing.assert_frame_equal(sort_table(res1.output_table), sort_table(res2.output_table))
+
+    def testLazyDatabase(self):
+        '''tables of database are saved separately and loaded when used'''
+        for db, targets, condition in [(ash_db, 'simulate.nsamp shrink.mixcompdist score.mse'.split(), ['simulate.nsamp > 20']),
+                                       (cause_db, 'simulate.q cis.ci_lwr cis.ci_upr summ_probs.prob cis'.split(), ['simulate.q < 0.5'])]:
+            data = pickle.load(open(db, 'rb'))
+            fn = os.path.join(self.tmp_dir, os.path.basename(db))
+            save_db(data, fn)
+            observed = load_db(fn)
+            self.assertEqual(list(observed.keys()), list(data.keys()))
+            tables = [k for k in data if isinstance(data[k], pd.DataFrame)]
+            self.assertFalse(any([observed.is_loaded(k) for k in tables]))
+            for k in tables:
+                self.assertEqual(observed.get_columns(k), list(data[k].columns))
+                pd.testing.assert_frame_equal(observed[k], data[k])
+            for k in ['.html', '.groups', '.output', '.pipelines']:
+                self.assertEqual(observed[k], data[k])
+            res1 = Query_Processor(db, targets, condition)
+            res2 = Query_Processor(fn, targets, condition)
+            self.assertEqual(res1.get_queries(), res2.get_queries())
+            pd.testing.assert_frame_equal(res1.output_table, res2.output_table)
+            # only tables of modules in queries are loaded
+            self.assertTrue(all([res2.data.is_loaded(k) for k in flatten_list(res2.pipelines)]))
+            self.assertFalse(any([res2.data.is_loaded(k) for k in tables
+                                  if k not in flatten_list(res2.pipelines)]))
+            # no table is loaded to query SQLite database in place
+            write_sqlite_db(data, fn[:-3] + '.sqlite')
+            res3 = Query_Processor(fn, targets, condition)
+            self.assertEqual(res3.sqlite_db, fn[:-3] + '.sqlite')
+            self.assertFalse(any([res3.data.is_loaded(k) for k in tables]))
+            pd.testing.assert_frame_equal(sort_table(res1.output_table), sort_table(res3.output_table))
+
+    def testPandasEngine(self):
+        '''pandas engine gives the same results as SQLite'''
+        for db, targets, condition in [(ash_db, 'simulate.nsamp shrink.mixcompdist score.mse'.split(), ['simulate.nsamp > 20', 'shrink.mixcompdist = "normal"']),
+                                       (ash_db, 'simulate shrink score'.split(), ['simulate.nsamp > 20 or shrink.mixcompdist != "normal"']),
+                                       (reg_db, 'simulate.scenario analyze score score.error'.split(), []),
+                                       (cause_db, 'simulate.q cis.ci_lwr cis.ci_upr summ_probs.prob cis'.split(), ['simulate.q < 0.5'])]:
+            res1 = Query_Processor(db, targets, condition)
+            res2 = Query_Processor(db, targets, condition, engine = 'pandas')
+            self.assertEqual(res1.get_queries(), res2.get_queries())
+            pd.testing.assert_frame_equal(sort_table(res1.output_table), sort_table(res2.output_table))
+        self.assertRaises(DBError, Query_Processor, reg_db, ['simulate'], engine = 'sql')
+
+
+    def testParallelQueries(self):
+        '''queries in parallel give identical output in the same order'''
+        for db, targets in [(reg_db, 'simulate.scenario analyze score score.error'.split()),
+                            (cause_db, 'simulate.q cis.ci_lwr cis.ci_upr summ_probs.prob cis'.split())]:
+            for engine in ['sqlite', 'pandas']:
+                res1 = Query_Processor(db, targets, engine = engine)
+                res2 = Query_Processor(db, targets, engine = engine, jobs = 4)
+                self.assertEqual(list(res1.output_tables.keys()), list(res2.output_tables.keys()))
+                pd.testing.assert_frame_equal(res1.output_table, res2.output_table)
+
+
+    def testQueryCache(self):
+        '''query results are cached and invalidated when database changes'''
+        db = os.path.join(self.tmp_dir, 'reg_result.db')
+        shutil.copy(reg_db, db)
+        cache = QueryCache(os.path.join(self.tmp_dir, '.query_cache'))
+        targets = 'simulate.scenario analyze score score.error'.split()
+        res1 = Query_Processor(db, targets, cache = cache)
+        res2 = Query_Processor(db, targets, cache = cache)
+        self.assertIsNotNone(res1.data)
+        self.assertIsNone(res2.data)
+        self.assertEqual(res1.get_queries(), res2.get_queries())
+        pd.testing.assert_frame_equal(res1.output_table, res2.output_table)
+        self.assertEqual(list(res1.output_tables.keys()), list(res2.output_tables.keys()))
+        for k in res1.output_tables:
+            pd.testing.assert_frame_equal(res1.output_tables[k], res2.output_tables[k])
+        # different query
+        res3 = Query_Processor(db, targets, ['analyze.alpha > 0'], cache = cache)
+        self.assertIsNotNone(res3.data)
+        # rebuilt database
+        data = pickle.load(open(db, 'rb'))
+        data['sq_err'] = data['sq_err'].iloc[:10]
+        pickle.dump(data, open(db, 'wb'))
+        res4 = Query_Processor(db, targets, cache = cache)
+        self.assertIsNotNone(res4.data)
+        self.assertEqual(len(res4.output_table), 10)
+        # least recently used results are removed
+        self.assertEqual(len([x for x in os.listdir(cache.path) if not x.endswith('.json')]), 3)
+        Query_Processor(db, targets, cache = cache)
+        cache.limit = 1
+        cache.evict()
+        self.assertEqual(len([x for x in os.listdir(cache.path) if not x.endswith('.json')]), 0)
+
+    def testArrowOutput(self):
+        '''query results are saved to parquet and Arrow IPC files'''
+        res = Query_Processor(reg_db, 'simulate.scenario analyze score.error'.split())
+        table = res.output_table.copy()
+        table['mixed'] = [1.5, 'NA'] * (len(table) // 2) + [1.5] * (len(table) % 2)
+        table['text'] = ['a', 1] * (len(table) // 2) + ['a'] * (len(table) % 2)
+        for ext in ['.parquet', '.feather']:
+            fn = os.path.join(self.tmp_dir, 'res' + ext)
+            save_arrow(table, fn)
+            observed = pd.read_parquet(fn) if ext == '.parquet' else pd.read_feather(fn)
+            self.assertEqual(list(observed.columns), list(table.columns))
+            self.assertEqual(observed['mixed'].dtype, float)
+            self.assertTrue(observed['mixed'].isnull().iloc[1])
+            self.assertEqual(list(observed['text'][:2]), ['a', '1'])
+            self.assertEqual(list(observed['analyze']), list(table['analyze']))
+
+    def testPushdown(self):
+        '''only needed columns and rows of tables are loaded'''
+        res = Query_Processor(ash_db, 'simulate.nsamp shrink.mixcompdist score.mse'.split(), ['simulate.nsamp > 20', 'shrink.mixcompdist = "normal"'])
+        for pipeline, plan in zip(res.pipelines, res.query_plans):
+            env = pushdown(pipeline, plan[0], plan[1], res.data)
+            self.assertEqual(sorted(env['simulate'].columns), sorted(['__id__', '__parent__', 'DSC_REPLICATE', 'nsamp']))
+            self.assertEqual(list(env['shrink']['mixcompdist'].unique()), ['normal'])
+            self.assertEqual(len(env[pipeline[0]]), len(res.data[pipeline[0]]))
+
+
+    def testLoadOutputs(self):
+        '''load values of module outputs from files'''
+        db = os.path.join(self.tmp_dir, 'reg_result.db')
+        shutil.copy(reg_db, db)
+        targets = 'simulate.scenario analyze score score.error score.DSC_TIME'.split()
+        res = Query_Processor(db, targets)
+        files = res.output_table['score.error:output'].tolist()
+        for idx, x in enumerate(files):
+            os.makedirs(os.path.join(self.tmp_dir, os.path.dirname(x)), exist_ok = True)
+            pickle.dump({'error': idx * 0.5, 'DSC_DEBUG': {'time': 1.5, 'replicate': 1}},
+                        open(os.path.join(self.tmp_dir, x + '.pkl'), 'wb'))
+        cache = OutputCache(os.path.join(self.tmp_dir, '.query_cache', 'outputs.sqlite'))
+        for jobs in [1, 2]:
+            res = Query_Processor(db, targets)
+            res.load_outputs(jobs, cache)
+            self.assertEqual(res.output_table['score.error'].tolist(), [idx * 0.5 for idx in range(len(files))])
+            self.assertEqual(res.output_table['score.DSC_TIME'].tolist(), [1.5] * len(files))
+            self.assertNotIn('score.error:output', res.output_table)
+        # values are taken from cache unless files are changed
+        fn = os.path.join(self.tmp_dir, files[0] + '.pkl')
+        mtime = os.stat(fn).st_mtime_ns
+        pickle.dump({'error': -1, 'DSC_DEBUG': {'time': 1.5}}, open(fn, 'wb'))
+        os.utime(fn, ns = (mtime, mtime))
+        res = Query_Processor(db, targets)
+        res.load_outputs(1, cache)
+        self.assertEqual(res.output_table['score.error'][0], 0)
+        os.utime(fn, ns = (mtime + 10 ** 9, mtime + 10 ** 9))
+        res = Query_Processor(db, targets)
+        res.load_outputs(1, cache)
+        self.assertEqual(res.output_table['score.error'][0], -1)
+
+
+    def testMaterializeOutputs(self):
+        '''query and filter on output values saved to database'''
+        db = os.path.join(self.tmp_dir, 'reg_result.db')
+        data = pickle.load(open(reg_db, 'rb'))
+        for idx, x in enumerate(data['sq_err']['__output__'].unique()):
+            os.makedirs(os.path.join(self.tmp_dir, os.path.dirname(x)), exist_ok = True)
+            pickle.dump({'error': float(idx), 'coef': [idx, idx + 1], 'fit': np.ones((3, 3)),
+                         'DSC_DEBUG': {'time': idx / 10, 'replicate': idx % 3 + 1}},
+                        open(os.path.join(self.tmp_dir, x + '.pkl'), 'wb'))
+        rdb = ResultDB.__new__(ResultDB)
+        rdb.prefix = db[:-3]
+        data['.output']['sq_err'] = ['error', 'coef', 'fit']
+        for jobs in [1, 2]:
+            rdb.data = dict([(k, v.copy()) for k, v in data.items() if isinstance(v, pd.DataFrame)])
+            values = rdb.load_outputs(rdb.get_output_vars(data['.output']), jobs)
+            self.assertEqual(rdb.materialize_outputs(values), {'sq_err': ['error', 'coef']})
+        self.assertEqual(rdb.data['sq_err']['error'].dtype, float)
+        self.assertEqual(rdb.data['sq_err']['coef'][0], (0, 1))
+        rdb.add_debug_info(rdb.load_outputs(dict([(k, ['DSC_TIME', 'DSC_REPLICATE']) for k in rdb.data])))
+        self.assertEqual(rdb.data['sq_err']['__replicate__'].tolist()[:4], [1, 2, 3, 1])
+        self.assertTrue(rdb.data['en']['DSC_TIME'].isna().all())
+        data.update(rdb.data)
+        data['.materialized'] = {'sq_err': ['error', 'coef']}
+        pickle.dump(data, open(db, 'wb'))
+        for engine in ['sqlite', 'pandas']:
+            res = Query_Processor(db, 'simulate analyze score.error score.fit'.split(), ['score.error > 10'], engine = engine)
+            self.assertTrue((res.output_table['score.error'] > 10).all())
+            self.assertEqual(len(res.output_table), len(data['sq_err']['__output__'].unique()) - 11)
+            self.assertIn('score.fit:output', res.output_table)
+            self.assertEqual(res.field_warnings, {})
+            res = Query_Processor(db, 'simulate analyze score.DSC_TIME'.split(), ['score.DSC_TIME < 1'], engine = engine)
+            self.assertEqual(sorted(res.output_table['score.DSC_TIME']), [x / 10 for x in range(10)])
+
+    def testIncrementalBuild(self):
+        '''database is updated with only pipeline modules added or changed'''
+        os.chdir(self.tmp_dir)
+        os.makedirs('.sos')
+        io = OrderedDict([('simulate:1', pipeline_module(instance('simulate', 'a1', n = 10), instance('simulate', 'a2', n = 20))),
+                          ('mean:1', pipeline_module(instance('mean', 'b1', 'simulate:a1'), instance('mean', 'b2', 'simulate:a2'))),
+                          ('simulate:2', pipeline_module(instance('simulate', 'a3', n = 30))),
+                          ('mean:2', pipeline_module(instance('mean', 'b3', 'simulate:a3')))])
+        meta = OrderedDict([(1, OrderedDict([('simulate', ['simulate', 1]), ('mean', ['mean', 1])])),
+                            (2, OrderedDict([('simulate', ['simulate', 2]), ('mean', ['mean', 2])]))])
+        db1 = build_db('res', io, meta)
+        self.assertEqual(db1['simulate']['n'].tolist(), [10, 20, 30])
+        # a new method in another pipeline, and a changed pipeline module
+        io['median:3'] = pipeline_module(instance('median', 'c1', 'simulate:a1', k = 1))
+        meta[3] = OrderedDict([('simulate', ['simulate', 1]), ('median', ['median', 3])])
+        io['mean:2'] = pipeline_module(instance('mean', 'b3', 'simulate:a3'), instance('mean', 'b4', 'simulate:a3'))
+        db2 = build_db('res', io, meta)
+        self.assertEqual(db2.lazy['simulate'], db1.lazy['simulate'])
+        self.assertNotEqual(db2.lazy['mean'], db1.lazy['mean'])
+        self.assertEqual([x.split(':')[1] for x in db2['mean']['__id__']], ['b1', 'b2', 'b3', 'b4'])
+        self.assertEqual(db2['mean']['__parent__'].tolist(), ['simulate:a1', 'simulate:a2', 'simulate:a3', 'simulate:a3'])
+        self.assertEqual(db2['median']['__parent__'].tolist(), ['simulate:a1'])
+        self.assertEqual(db2['median']['__output__'].tolist(), ['median/simulate_1_median_1'])
+        # same as database built from scratch, one module per process
+        tables = dict([(k, db2[k]) for k in ['simulate', 'mean', 'median']])
+        os.remove('res/res.db')
+        shutil.rmtree('res/res.tables')
+        db3 = build_db('res', io, meta, jobs = 3)
+        for k in tables:
+            pd.testing.assert_frame_equal(tables[k], db3[k])
+        self.assertEqual(db2['.output'], db3['.output'])
+        self.assertEqual(db2['.build'], db3['.build'])
+        # removed pipeline modules
+        del io['median:3']
+        del meta[3]
+        db4 = build_db('res', io, meta)
+        self.assertNotIn('median', db4)
+        self.assertEqual(len(os.listdir('res/res.tables')), 2)
+
+    def testNameMap(self):
+        '''file names of module instances are kept in SQLite, imported from legacy map'''
+        data = OrderedDict([('simulate:a1', 'simulate/simulate_1.pkl'), ('simulate:a2', 'simulate/simulate_2.pkl'),
+                            ('__base_ids__', {'simulate': {'simulate': 2}})])
+        open(os.path.join(self.tmp_dir, 'res.map.mpk'), 'wb').write(msgpack.packb(data))
+        names = NameMap(os.path.join(self.tmp_dir, 'res.map.sqlite'))
+        self.assertEqual(len(names), 2)
+        self.assertEqual(names['simulate:a2'], 'simulate/simulate_2.pkl')
+        self.assertNotIn('simulate:a3', names)
+        self.assertEqual(names.get_base_ids(), {'simulate': {'simulate': 2}})
+        names.update([('simulate:a3', 'simulate/simulate_3.pkl')], {'simulate': {'simulate': 3}})
+        self.assertEqual(names.get_many(['simulate:a1', 'simulate:a3', 'simulate:a4']),
+                         {'simulate:a1': 'simulate/simulate_1.pkl', 'simulate:a3': 'simulate/simulate_3.pkl'})
+        names.close()
+        # entries of missing files are removed
+        os.makedirs(os.path.join(self.tmp_dir, 'simulate'))
+        open(os.path.join(self.tmp_dir, 'simulate/simulate_2.pkl'), 'w').close()
+        names = NameMap(os.path.join(self.tmp_dir, 'res.map.sqlite'))
+        self.assertEqual(names.get_base_ids(), {'simulate': {'simulate': 3}})
+        self.assertEqual(sorted(names.compact(self.tmp_dir)),
+                         [os.path.join(self.tmp_dir, f'simulate/simulate_{i}.pkl') for i in [1, 3]])
+        self.assertEqual(list(names.items()), [('simulate:a2', 'simulate/simulate_2.pkl')])
+        names.update([], clear = True)
+        self.assertEqual(len(names), 0)
+        names.close()
+
+
+    def testRemoveObsoleteOutput(self):
+        '''files not in name map are removed, keeping placeholders, stdout and stderr'''
+        output = os.path.join(self.tmp_dir, 'res')
+        os.makedirs(os.path.join(output, 'simulate'))
+        names = NameMap(os.path.join(output, 'res.map.sqlite'))
+        names.update([(f'simulate:a{i}', f'simulate/simulate_{i}.pkl') for i in range(1, 5)])
+        names.close()
+        for x in ['simulate_1.pkl', 'simulate_1.stdout', 'simulate_2.pkl.zapped', 'simulate_2.stderr',
+                  'simulate_3.pkl', 'simulate_5.pkl', 'simulate_5.stdout', 'old.txt']:
+            with open(os.path.join(output, 'simulate', x), 'w') as f:
+                f.write('x' * 10)
+        os.makedirs(os.path.join(output, 'res.tables'))
+        open(os.path.join(output, 'res.tables', 'simulate.arrow'), 'w').close()
+        open(os.path.join(output, 'res.db'), 'w').close()
+        obsolete = [os.path.join(output, 'simulate', x) for x in ['old.txt', 'simulate_5.pkl', 'simulate_5.stdout']]
+        res = remove_obsolete_output(output, dryrun = True)
+        self.assertEqual(sorted(res), obsolete)
+        self.assertEqual(sum(res.values()), 30)
+        self.assertTrue(all([os.path.isfile(x) for x in obsolete]))
+        remove_obsolete_output(output)
+        self.assertEqual(sorted(os.listdir(os.path.join(output, 'simulate'))),
+                         ['simulate_1.pkl', 'simulate_1.stdout', 'simulate_2.pkl.zapped', 'simulate_2.stderr', 'simulate_3.pkl'])
+        self.assertTrue(os.path.isfile(os.path.join(output, 'res.tables', 'simulate.arrow')))
+        self.assertTrue(os.path.isfile(os.path.join(output, 'res.db')))
+        names = NameMap(os.path.join(output, 'res.map.sqlite'))
+        self.assertEqual(len(names), 3)
+        self.assertNotIn('simulate:a4', names)
+        names.close()
+
+
+    def testColumnTypes(self):
+        '''numeric and repetitive text columns are typed, and queried as text columns'''
+        table = pd.DataFrame({'__id__': ['b1', 'b2', 'b3', 'b4'], '__parent__': ['a1', 'a1', 'a2', None],
+                              'n': pd.Series([1, 2, 3, 4], dtype = object), 'method': ['lm', 'lm', 'glm', 'lm'],
+                              'prior': [(1, 2), (1, 2), 3, 'x']})
+        table = set_column_types(table)
+        self.assertEqual([str(x) for x in table.dtypes], ['object', 'category', 'int64', 'category', 'object'])
+        save_db(dict(mean = table), os.path.join(self.tmp_dir, 'res.db'))
+        pd.testing.assert_frame_equal(load_db(os.path.join(self.tmp_dir, 'res.db'))['mean'], table)
+        res = pdquery(['mean'], [('mean.method', 'mean', 'method'), ('mean.parent', 'mean', '__parent__')],
+                      [[[(False, 'mean', 'method', '!=', "'glm'")]], [[(False, 'mean', 'method', '>', "'l'")]]],
+                      dict(mean = table))
+        self.assertEqual(res['mean.method'].tolist(), ['lm', 'lm', 'lm'])
+        self.assertEqual(res['mean.parent'].tolist(), ['a1', 'a1', None])
+
+
+    def testMergeOutput(self):
+        '''output folders of parts of a benchmark are merged to one'''
+        os.chdir(self.tmp_dir)
+        os.makedirs('.sos')
+        meta = OrderedDict([(1, OrderedDict([('simulate', ['simulate', 1]), ('mean', ['mean', 1])]))])
+        # replicate 1 in one shard, replicates 1 and 2 in the other
+        build_db('res1', OrderedDict([('simulate:1', pipeline_module(instance('simulate', 'a1', n = 1, DSC_REPLICATE = 1))),
+                                      ('mean:1', pipeline_module(instance('mean', 'b1', 'simulate:a1')))]), meta)
+        build_db('res2', OrderedDict([('simulate:1', pipeline_module(instance('simulate', 'a2', n = 2, DSC_REPLICATE = 2), instance('simulate', 'a1', n = 1, DSC_REPLICATE = 1))),
+                                      ('mean:1', pipeline_module(instance('mean', 'b2', 'simulate:a2'), instance('mean', 'b1', 'simulate:a1')))]), meta)
+        for name in ['res1', 'res2']:
+            names = NameMap(f'{name}/{name}.map.sqlite')
+            for k, x in names.items().fetchall():
+                os.makedirs(os.path.join(name, os.path.dirname(x)), exist_ok = True)
+                with open(os.path.join(name, x), 'w') as f:
+                    f.write(f'{name} {k}')
+            names.close()
+        merge_output(['res1', 'res2'], 'res')
+        db = load_db('res/res.db')
+        self.assertEqual(db['simulate']['n'].tolist(), [1, 2])
+        self.assertEqual(db['mean']['__parent__'].tolist(), ['simulate:a1', 'simulate:a2'])
+        names = NameMap('res/res.map.sqlite')
+        self.assertEqual(len(set(names.values())), 4)
+        for table in [db['simulate'], db['mean']]:
+            for k, x in zip(table['__id__'], table['__output__']):
+                self.assertEqual(names[k], x + '.pkl')
+                # linked from the shard where it is first found
+                self.assertEqual(open(os.path.join('res', x + '.pkl')).read(),
+                                 f'{"res1" if k.endswith("1") else "res2"} {k}')
+        self.assertEqual(names.get_base_ids()['simulate:mean'], {'simulate': 2, 'mean': 3})
+        names.close()
+        res = Query_Processor('res/res.db', ['simulate.n', 'mean'])
+        self.assertEqual(sorted(res.output_table['simulate.n']), [1, 2])
+        self.assertRaises(DBError, merge_output, ['res1', 'res2'], 'res')
+
+
+    def testFederatedQuery(self):
+        '''the same query on several databases, with source of rows'''
+        dbs = []
+        for x in ['v1', 'v2']:
+            os.makedirs(os.path.join(self.tmp_dir, x))
+            dbs.append(os.path.join(self.tmp_dir, x, f'{x}.db'))
+            shutil.copy(reg_db, dbs[-1])
+        targets, condition = 'simulate.n analyze.alpha score'.split(), ['analyze.alpha > 0']
+        expected = Query_Processor(reg_db, targets, condition)
+        for jobs in [1, 2]:
+            res = Federated_Query_Processor(dbs, targets, condition, jobs = jobs)
+            self.assertEqual(res.sources, ['v1', 'v2'])
+            self.assertEqual(res.get_queries(), expected.get_queries())
+            self.assertEqual(list(res.output_table.columns), ['source'] + list(expected.output_table.columns))
+            for source in res.sources:
+                pd.testing.assert_frame_equal(
+                    res.output_table.loc[res.output_table['source'] == source].drop(columns = 'source').reset_index(drop = True),
+                    expected.output_table)
+            self.assertEqual(list(res.output_tables), list(expected.output_tables))
+        self.assertEqual(Federated_Query_Processor.get_sources(['a/res.db', 'b/res.db']),
+                         [os.path.abspath('a'), os.path.abspath('b')])
+
 
 if __name__ == '__main__':
     #suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestParser)
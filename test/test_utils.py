@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Gao Wang, Stephens Lab at The Univeristy of Chicago
+# Distributed under the terms of the MIT License.
+
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from collections import OrderedDict
+
+import msgpack
+from dsc.utils import dump_mpk_records, load_mpk_records, load_io_db, MpkRecords, MpkRecordsWriter, \
+    sos_hash_output, sos_batch_script, xxh
+
+class TestUtils(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testMpkRecords(self):
+        '''records of msgpack files are streamed and loaded by key'''
+        data = OrderedDict([(str(i), OrderedDict([('simulate', OrderedDict([('input', []), ('output', [f'simulate_{i}.pkl'])])),
+                                                   ('mean', ('1', 'mean'))]))
+                            for i in range(1, 6)])
+        fn = os.path.join(self.tmp_dir, 'records.mpk')
+        dump_mpk_records(fn, ((k, v) for k, v in data.items()))
+        legacy = os.path.join(self.tmp_dir, 'legacy.mpk')
+        open(legacy, 'wb').write(msgpack.packb(data))
+        for f in [fn, legacy]:
+            records = MpkRecords(f)
+            self.assertEqual(list(records), list(data))
+            self.assertIn('3', records)
+            self.assertEqual(records['4']['simulate']['output'], ['simulate_4.pkl'])
+            self.assertEqual(load_mpk_records(f), load_io_db(f))
+            self.assertEqual(list(load_io_db(f).keys()), list(data))
+            self.assertEqual(load_io_db(f, '2', 'mean'), ['1', 'mean'])
+            self.assertEqual(load_io_db(f, '5', 'simulate')['output'], ['simulate_5.pkl'])
+        self.assertEqual(len(list(MpkRecords(fn).stream())), 5)
+        # integer keys
+        dump_mpk_records(fn, [(1, {'a': 1}), (2, {'b': 2})])
+        self.assertEqual(load_mpk_records(fn), OrderedDict([(1, {'a': 1}), (2, {'b': 2})]))
+        # records written one at a time
+        with MpkRecordsWriter(fn) as writer:
+            writer['simulate:1'] = {'a': 1}
+            self.assertRaises(ValueError, writer.__setitem__, 'simulate:1', {'a': 2})
+            writer['mean:1'] = {'b': 2}
+        self.assertEqual(load_mpk_records(fn), OrderedDict([('simulate:1', {'a': 1}), ('mean:1', {'b': 2})]))
+        # file is left untouched on error
+        with self.assertRaises(KeyError):
+            with MpkRecordsWriter(fn) as writer:
+                writer['simulate:2'] = {}[0]
+        self.assertEqual(list(load_mpk_records(fn)), ['simulate:1', 'mean:1'])
+        self.assertFalse(os.path.exists(fn + '.tmp'))
+
+    def testHashOutput(self):
+        '''hashes of module instances are the same when hashed in one call'''
+        values = [f'mean mean.R x:{i} y:{i % 7}' for i in range(1000)]
+        self.assertEqual(sos_hash_output(values), [xxh(x).hexdigest() for x in values])
+        self.assertEqual(sos_hash_output(iter(values)), [xxh(x).hexdigest() for x in values])
+
+    def testBatchScript(self):
+        '''module instances of a batch run in one process with output of their own'''
+        script = "import pickle\nx = [pickle.load(open(f, 'rb')) for f in [${paths(_input):r,}]]\n" \
+                 "print('instance', ${_n})\npickle.dump(sum(x) + ${_n}, open(${_output:r}, 'wb'))\n"
+        inputs = [os.path.join(self.tmp_dir, f'in_{i}.pkl') for i in range(2)]
+        for i, fn in enumerate(inputs):
+            pickle.dump(i + 1, open(fn, 'wb'))
+        outputs = [os.path.join(self.tmp_dir, f'out_{i}.pkl') for i in range(3)]
+        instances = [dict(_n=10, _output=outputs[0], _input=inputs),
+                     dict(_n=20, _output=outputs[1], _input=inputs[:1]),
+                     dict(_n=30, _output=outputs[2])]
+        with open(os.path.join(self.tmp_dir, 'batch.py'), 'w') as f:
+            f.write(sos_batch_script(script, 'python', instances))
+        subprocess.check_call([sys.executable, os.path.join(self.tmp_dir, 'batch.py')])
+        self.assertEqual([pickle.load(open(fn, 'rb')) for fn in outputs], [13, 21, 30])
+        self.assertEqual(open(os.path.join(self.tmp_dir, 'out_1.stdout')).read(), 'instance 20\n')
+
+if __name__ == '__main__':
+    unittest.main()
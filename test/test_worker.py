@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Gao Wang, Stephens Lab at The Univeristy of Chicago
+# Distributed under the terms of the MIT License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from multiprocessing.connection import Client
+
+from dsc.dsc_worker import WorkerPool, sos_run_worker, WORKER_ADDRESS, WORKER_AUTHKEY
+
+script = "import os, pickle\nif ${_n} == 0: raise ValueError('zero')\nif ${_n} < 0: os._exit(1)\n" \
+         "print('instance', ${_n})\npickle.dump((${_n}, os.getpid()), open(${_output:r}, 'wb'))\n"
+
+class TestWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testWorkerPool(self):
+        '''module instances run in long-lived workers, which survive errors and are replaced after crashes'''
+        outputs = [os.path.join(self.tmp_dir, f'out_{i}.pkl') for i in range(6)]
+        with WorkerPool(1):
+            sos_run_worker(script, [dict(_n=10, _output=outputs[0])])
+            with self.assertRaises(RuntimeError):
+                sos_run_worker(script, [dict(_n=0, _output=outputs[1])])
+            sos_run_worker(script, [dict(_n=20, _output=outputs[2])])
+            with self.assertRaises(RuntimeError):
+                sos_run_worker(script, [dict(_n=-1, _output=outputs[4])])
+            sos_run_worker(script, [dict(_n=30, _output=outputs[3])])
+            # clients gone before or after sending a job
+            for job in [None, ([], [], None)]:
+                conn = Client(os.environ[WORKER_ADDRESS], family = 'AF_UNIX',
+                              authkey = bytes.fromhex(os.environ[WORKER_AUTHKEY]))
+                if job:
+                    conn.send(job)
+                conn.close()
+            sos_run_worker(script, [dict(_n=40, _output=outputs[5])])
+        res = [pickle.load(open(outputs[i], 'rb')) for i in [0, 2, 3, 5]]
+        self.assertEqual([x[0] for x in res], [10, 20, 30, 40])
+        self.assertEqual(res[0][1], res[1][1])
+        self.assertNotEqual(res[1][1], res[2][1])
+        self.assertEqual(res[2][1], res[3][1])
+        self.assertEqual(open(os.path.join(self.tmp_dir, 'out_2.stdout')).read(), 'instance 20\n')
+        self.assertIn('ValueError: zero', open(os.path.join(self.tmp_dir, 'out_1.stderr')).read())
+        self.assertNotIn(WORKER_ADDRESS, os.environ)
+
+if __name__ == '__main__':
+    unittest.main()